@@ -196,6 +196,13 @@ COMMANDS_DICT = {
                 "value": True,
                 "default": False,
             },
+            "--local": {
+                "altName": "-l",
+                "help": "Search titles, contents, tags and notebooks in the "
+                "local index built by 'sync-metadata --with-content'.",
+                "value": True,
+                "default": False,
+            },
         },
     },
     "edit": {
@@ -324,6 +331,24 @@ COMMANDS_DICT = {
             }
         },
     },
+    "sync-metadata": {
+        "help": "Download the metadata of all notes, notebooks and tags, "
+        "so searches and lists can be answered locally.",
+        "flags": {
+            "--full": {
+                "help": "Download everything again instead of the changes only.",
+                "value": True,
+                "default": False,
+            },
+            "--with-content": {
+                "altName": "-wc",
+                "help": "Also download the text of new and changed notes "
+                "for 'find --local'.",
+                "value": True,
+                "default": False,
+            },
+        },
+    },
     # Notebooks
     "notebook-list": {
         "help": "Show the list of existing notebooks in your Evernote.",
@@ -31,6 +31,50 @@ CONSUMER_SECRET_SANDBOX = "ed0fcc0c97c032a5"
 # can be one of: UPDATED, CREATED, RELEVANCE, TITLE, UPDATE_SEQUENCE_NUMBER
 NOTE_SORT_ORDER = "UPDATED"
 
+# Keep-alive connections shared by all NoteStore/UserStore clients:
+# idle connections kept open, seconds before an idle connection is closed,
+# maximum simultaneous connections to one host
+CONNECTION_POOL_SIZE = 8
+CONNECTION_POOL_IDLE_TIMEOUT = 60
+CONNECTION_POOL_PER_HOST = 4
+# Socket timeout of a store request, in seconds (None means no timeout)
+CONNECTION_TIMEOUT = 60
+# Retries of read-only calls after network failures: maximum attempts,
+# backoff base and cap in seconds, and seconds before a call is given up
+RETRY_ATTEMPTS = 5
+RETRY_BASE_DELAY = 0.5
+RETRY_MAX_DELAY = 15
+RETRY_DEADLINE = 120
+# Worker threads making concurrent API calls (GeekNote.submit/map)
+CONCURRENCY = 4
+# Notes asked for in one findNotesMetadata call, the most the server returns
+FIND_PAGE_SIZE = 250
+
+# Client-side throttling of API calls (shared by all geeknote/gnsync processes):
+# sustained calls per second, burst size, and the hourly call budget
+# reported after each command. Evernote does not publish its limits,
+# these are conservative estimates.
+RATE_LIMIT_RATE = 5
+RATE_LIMIT_BURST = 20
+RATE_LIMIT_BUDGET = 2000
+
+# Record every store request and response of a session to a file, or answer
+# them from such a file without network; replayed answers can be delayed by
+# a number of seconds or by the recorded latency ("recorded")
+RECORD_FILE = os.getenv("GEEKNOTE_RECORD")
+REPLAY_FILE = os.getenv("GEEKNOTE_REPLAY")
+REPLAY_LATENCY = os.getenv("GEEKNOTE_REPLAY_LATENCY")
+
+# Seconds the note store url, EDAM version check and user ids are kept
+# in the local database before they are asked from the server again
+SESSION_CACHE_TTL = 86400
+
+# Local replica of the note, notebook and tag metadata (geeknote sync-metadata):
+# entries asked for in one sync chunk, and seconds a synced replica is
+# trusted before its update count is compared with the server's again
+REPLICA_CHUNK_SIZE = 250
+REPLICA_MAX_AGE = 300
+
 # Evernote config
 
 try:
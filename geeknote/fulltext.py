@@ -0,0 +1,102 @@
+"""
+Offline full-text search over the notes of the metadata replica
+"""
+
+import re
+
+from . import config
+from .log import logging
+
+
+def toQuery(search, exact=False):
+    """
+    FTS5 query of a search text: every word must be found,
+    a trailing * matches words starting with it
+    exact searches for the whole text as a phrase
+    """
+    if exact:
+        return '"%s"' % search.replace('"', '""')
+
+    terms = []
+    for word in search.split():
+        prefix = word.endswith("*")
+        word = word.rstrip("*").replace('"', '""')
+        if word:
+            terms.append('"%s"%s' % (word, "*" if prefix else ""))
+    return " ".join(terms)
+
+
+class SearchIndex(object):
+    """
+    SQLite FTS5 index of the title, plain text, tags and notebook of every
+    note in the replica. Only notes whose update count (USN) differs from
+    the indexed one have their text downloaded again.
+    """
+
+    def __init__(self, geeknote):
+        self.geeknote = geeknote
+
+    def update(self):
+        """
+        Index the notes of the replica which are new or have changed
+        returns a dict with the number of indexed, renamed and removed notes
+        """
+        storage = self.geeknote.getStorage()
+        notes = dict(
+            (note.guid, note) for note in storage.getNotes() or [] if not note.deleted
+        )
+        tagNames = storage.getTags() or {}
+        notebookNames = storage.getNotebooks() or {}
+        indexed = storage.getIndexedNotes()
+        if indexed is False:
+            raise Exception("SQLite full-text search (FTS5) is not available")
+
+        def names(note):
+            tags = " ".join(
+                tagNames[guid] for guid in note.tagGuids or [] if guid in tagNames
+            )
+            return tags, notebookNames.get(note.notebookGuid, "")
+
+        changed = []
+        renamed = []
+        for guid, note in notes.items():
+            if guid not in indexed or indexed[guid][0] != note.updateSequenceNum:
+                changed.append(note)
+            elif tuple(indexed[guid][1:]) != names(note):
+                renamed.append((guid,) + names(note))
+
+        removed = [guid for guid in indexed if guid not in notes]
+        storage.removeIndexedNotes(removed)
+        storage.renameIndexedNotes(renamed)
+
+        logging.debug("Downloading the text of %d notes", len(changed))
+        texts = self.geeknote.map(
+            self.geeknote.getNoteSearchText, [note.guid for note in changed]
+        )
+        rows = []
+        for note, text in zip(changed, texts):
+            rows.append(
+                (note.guid, note.updateSequenceNum, note.title, text or "")
+                + names(note)
+            )
+            # keep what has been downloaded if the update gets interrupted
+            if len(rows) >= config.REPLICA_CHUNK_SIZE:
+                storage.indexNotes(rows)
+                rows = []
+        storage.indexNotes(rows)
+
+        return {"indexed": len(changed), "renamed": len(renamed), "removed": len(removed)}
+
+    def search(self, search, exact=False, limit=None):
+        """
+        Search the index
+        returns list of (guid, snippet) tuples, best matches first
+        returns None if the index is not available
+        """
+        query = toQuery(search, exact)
+        if not query:
+            return []
+        result = self.geeknote.getStorage().searchIndex(query, limit or -1)
+        if result is False:
+            return None
+        return [(guid, re.sub(r"\s+", " ", snippet or "")) for guid, snippet in result]
@@ -8,13 +8,13 @@ import mimetypes
 import hashlib
 import re
 import traceback
-
-import thrift.protocol.TBinaryProtocol as TBinaryProtocol
-import thrift.transport.THttpClient as THttpClient
+import threading
+import collections
+from concurrent.futures import ThreadPoolExecutor
 
 import evernote2.edam.userstore.constants as UserStoreConstants
 import evernote2.edam.notestore.NoteStore as NoteStore
-from evernote2.edam.notestore.ttypes import NotesMetadataResultSpec
+from evernote2.edam.notestore.ttypes import NotesMetadataResultSpec, NotesMetadataList
 import evernote2.edam.type.ttypes as Types
 from evernote2.edam.limits.constants import EDAM_USER_NOTES_MAX
 from evernote2.edam.error.ttypes import EDAMNotFoundException
@@ -23,6 +23,13 @@ from .__init__ import __version__
 from . import config
 from . import tools
 from . import out
+from . import transport
+from .ratelimit import governor
+from .stats import stats
+from .retry import RetryingClient
+from .namecache import NameCache
+from .replica import Replica
+from .fulltext import SearchIndex
 from .editor import Editor, EditorThread
 from .gclient import GUserStore as UserStore
 from .argparser import argparser
@@ -73,23 +80,54 @@ def make_resource(filename):
         raise IOError(msg)
 
 
+# NoteMetadata fields a NotesMetadataResultSpec can ask for
+METADATA_FIELDS = (
+    "title",
+    "contentLength",
+    "created",
+    "updated",
+    "deleted",
+    "updateSequenceNum",
+    "notebookGuid",
+    "tagGuids",
+    "attributes",
+    "largestResourceMime",
+    "largestResourceSize",
+)
+# fields shown by out.printList
+LIST_FIELDS = ["title", "created", "updated"]
+
+
 class GeekNote(object):
     userStoreUri = config.USER_STORE_URI
     consumerKey = config.CONSUMER_KEY
     consumerSecret = config.CONSUMER_SECRET
     noteSortOrder = config.NOTE_SORT_ORDER
     authToken = None
-    userStore = None
-    noteStore = None
     storage = None
     skipInitConnection = False
     sharedAuthToken = None
     sharedNoteStore = None
-
-    def __init__(self, skipInitConnection=False, sleepOnRateLimit=False):
+    # thrift clients are not thread-safe, every thread gets its own store clients
+    local = threading.local()
+    lock = threading.RLock()
+    versionChecked = False
+    noteStoreUrl = None
+    executor = None
+    concurrency = config.CONCURRENCY
+    nameCache = None
+    replica = None
+    searchIndex = None
+
+    def __init__(
+        self, skipInitConnection=False, sleepOnRateLimit=False, concurrency=None
+    ):
         if skipInitConnection:
             self.skipInitConnection = True
 
+        if concurrency:
+            self.concurrency = concurrency
+
         self.getStorage()
 
         if self.skipInitConnection is True:
@@ -118,6 +156,9 @@ class GeekNote(object):
                         if errorCode == 9:
                             storage = Storage()
                             storage.removeUser()
+                            # the cached note store url may belong to the old token
+                            GeekNote.noteStoreUrl = None
+                            GeekNote.local = threading.local()
                             GeekNote(sleepOnRateLimit=sleepOnRateLimit)
                             return func(*args, **kwargs)
 
@@ -132,12 +173,15 @@ class GeekNote(object):
                         # Patched because otherwise if you get rate limited you still keep
                         # hammering the server on scripts
                         elif errorCode == 19:
+                            # let other threads and processes back off too
+                            governor.backoff(e.rateLimitDuration)
+                            stats.count("rateLimitHits")
                             if sleepOnRateLimit:
                                 print(
                                     "\nRate Limit Hit: Sleeping %s seconds before continuing"
                                     % str(e.rateLimitDuration)
                                 )
-                                time.sleep(e.rateLimitDuration)
+                                governor.wait()
                             else:
                                 print(
                                     "\nRate Limit Hit: Please wait %s seconds before continuing"
@@ -171,27 +215,107 @@ class GeekNote(object):
         return GeekNote.storage
 
     def getUserStore(self):
-        if GeekNote.userStore:
-            return GeekNote.userStore
+        userStore = getattr(GeekNote.local, "userStore", None)
+        if userStore:
+            return userStore
+
+        userStoreProtocol = transport.getProtocol(self.userStoreUri)
+        GeekNote.local.userStore = RetryingClient(UserStore.Client(userStoreProtocol))
+
+        with GeekNote.lock:
+            if not GeekNote.versionChecked:
+                GeekNote.versionChecked = True
+                versionKey = "checkVersion:%s.%s" % (
+                    UserStoreConstants.EDAM_VERSION_MAJOR,
+                    UserStoreConstants.EDAM_VERSION_MINOR,
+                )
+                if not self.getStorage().getCache(
+                    versionKey, config.SESSION_CACHE_TTL
+                ):
+                    self.checkVersion()
+                    self.getStorage().setCache(versionKey, True)
 
-        userStoreHttpClient = THttpClient.THttpClient(self.userStoreUri)
-        userStoreProtocol = TBinaryProtocol.TBinaryProtocol(userStoreHttpClient)
-        GeekNote.userStore = UserStore.Client(userStoreProtocol)
+        return GeekNote.local.userStore
 
-        self.checkVersion()
+    def getNoteStoreUrl(self):
+        with GeekNote.lock:
+            if not GeekNote.noteStoreUrl:
+                noteStoreUrl = self.getStorage().getCache(
+                    "noteStoreUrl", config.SESSION_CACHE_TTL
+                )
+                if not noteStoreUrl:
+                    noteStoreUrl = self.getUserStore().getNoteStoreUrl(self.authToken)
+                    self.getStorage().setCache("noteStoreUrl", noteStoreUrl)
+                GeekNote.noteStoreUrl = noteStoreUrl
 
-        return GeekNote.userStore
+        return GeekNote.noteStoreUrl
 
     def getNoteStore(self):
-        if GeekNote.noteStore:
-            return GeekNote.noteStore
-
-        noteStoreUrl = self.getUserStore().getNoteStoreUrl(self.authToken)
-        noteStoreHttpClient = THttpClient.THttpClient(noteStoreUrl)
-        noteStoreProtocol = TBinaryProtocol.TBinaryProtocol(noteStoreHttpClient)
-        GeekNote.noteStore = NoteStore.Client(noteStoreProtocol)
-
-        return GeekNote.noteStore
+        noteStore = getattr(GeekNote.local, "noteStore", None)
+        if noteStore:
+            return noteStore
+
+        noteStoreProtocol = transport.getProtocol(self.getNoteStoreUrl())
+        GeekNote.local.noteStore = RetryingClient(NoteStore.Client(noteStoreProtocol))
+
+        return GeekNote.local.noteStore
+
+    def getLinkedNoteStore(self, noteStoreUrl):
+        """ NoteStore of a linked notebook, sharing the pooled connections """
+        return RetryingClient(NoteStore.Client(transport.getProtocol(noteStoreUrl)))
+
+    def getNameCache(self):
+        with GeekNote.lock:
+            if GeekNote.nameCache is None:
+                GeekNote.nameCache = NameCache(self)
+        return GeekNote.nameCache
+
+    def getReplica(self):
+        with GeekNote.lock:
+            if GeekNote.replica is None:
+                GeekNote.replica = Replica(self)
+        return GeekNote.replica
+
+    def getSearchIndex(self):
+        with GeekNote.lock:
+            if GeekNote.searchIndex is None:
+                GeekNote.searchIndex = SearchIndex(self)
+        return GeekNote.searchIndex
+
+    def metadataChanged(self, kind=None):
+        """
+        Forget cached tag/notebook names and check the replica
+        before its next use, after `kind` has been changed on the server
+        """
+        if kind in NameCache.KINDS:
+            self.getNameCache().invalidate(kind)
+        self.getReplica().invalidate()
+
+    def getExecutor(self):
+        with GeekNote.lock:
+            if GeekNote.executor is None:
+                GeekNote.executor = ThreadPoolExecutor(
+                    max_workers=self.concurrency, thread_name_prefix="geeknote"
+                )
+        return GeekNote.executor
+
+    def submit(self, func, *args, **kwargs):
+        """
+        Run func(*args, **kwargs) in the worker pool
+        returns a concurrent.futures.Future
+        """
+        # resolve the note store url here, the local database
+        # must not be used from the worker threads
+        self.getNoteStoreUrl()
+        return self.getExecutor().submit(func, *args, **kwargs)
+
+    def map(self, func, *iterables):
+        """
+        Like the builtin map(), but calls are made concurrently
+        in the worker pool. Results are returned in order.
+        """
+        self.getNoteStoreUrl()
+        return self.getExecutor().map(func, *iterables)
 
     def checkVersion(self):
         versionOK = self.getUserStore().checkVersion(
@@ -252,6 +376,18 @@ class GeekNote(object):
     def getUserInfo(self):
         return self.getUserStore().getUser(self.authToken)
 
+    def getUserIds(self):
+        """
+        Get (userId, shardId) of the logged in user, needed for note links
+        Asks the server only when the cached values are missing or expired
+        """
+        ids = self.getStorage().getCache("userIds", config.SESSION_CACHE_TTL)
+        if not ids:
+            userInfo = self.getUserInfo()
+            ids = (userInfo.id, userInfo.shardId)
+            self.getStorage().setCache("userIds", ids)
+        return ids
+
     def removeUser(self):
         return self.getStorage().removeUser()
 
@@ -275,11 +411,7 @@ class GeekNote(object):
             withResourcesAlternateData,
         )
 
-    @EdamException
-    def findNotes(
-        self, keywords, count, createOrder=False, offset=0, deletedOnly=False
-    ):
-        """ WORK WITH NOTES """
+    def getNoteFilter(self, keywords, createOrder=False, deletedOnly=False):
         noteFilter = NoteStore.NoteFilter(order=Types.NoteSortOrder.RELEVANCE)
         noteFilter.order = getattr(Types.NoteSortOrder, self.noteSortOrder)
         if createOrder:
@@ -291,42 +423,55 @@ class GeekNote(object):
         if deletedOnly:
             noteFilter.inactive = True
 
+        return noteFilter
+
+    def getMetadataSpec(self, fields=None):
+        """
+        Result spec asking only for the given NoteMetadata fields,
+        e.g. ["title", "updated"]; the guid is always returned
+        All fields are asked for if fields is None
+        """
         meta = NotesMetadataResultSpec()
-        meta.includeTitle = True
-        meta.includeContentLength = True
-        meta.includeCreated = True
-        meta.includeUpdated = True
-        meta.includeNotebookGuid = True
-        meta.includeAttributes = True
-        meta.includeTagGuids = True
-        meta.includeLargestResourceMime = True
-        meta.includeLargestResourceSize = True
-
-        result = self.getNoteStore().findNotesMetadata(
-            self.authToken, noteFilter, offset, count, meta
+        for field in fields or METADATA_FIELDS:
+            include = "include" + field[0].upper() + field[1:]
+            if not hasattr(meta, include):
+                raise ValueError("Unknown note metadata field: %s" % field)
+            setattr(meta, include, True)
+        return meta
+
+    @EdamException
+    def findNotesPage(self, noteFilter, offset, maxNotes, meta):
+        return self.getNoteStore().findNotesMetadata(
+            self.authToken, noteFilter, offset, maxNotes, meta
         )
 
-        # Reduces the count by the amount of notes already retrieved
-        # In none are initially retrieved, presume no more exist to retrieve
-        if result.notes:
-            count = max(count - len(result.notes), 0)
-        else:
-            count = 0
-
-        # Evernote api will only return so many notes in one go. Checks for more
-        # notes to come whilst obeying count rules
-        while (result.totalNotes != len(result.notes)) and count != 0:
-            offset = len(result.notes)
-            newresult = self.getNoteStore().findNotesMetadata(
-                self.authToken, noteFilter, offset, count, meta
-            )
-            if newresult.notes:
-                result.notes += newresult.notes
-                count = max(count - len(newresult.notes), 0)
-            else:
-                count = 0
+    def iterNotes(self, noteFilter, meta=None, count=EDAM_USER_NOTES_MAX, offset=0):
+        """
+        NoteMetadata of the notes matching noteFilter, fetched page by page
+        returns a NotesIterator, iterate it to get the notes
+        """
+        return NotesIterator(self, noteFilter, meta or self.getMetadataSpec(), count, offset)
 
-        return result
+    @EdamException
+    def findNotes(
+        self,
+        keywords,
+        count,
+        createOrder=False,
+        offset=0,
+        deletedOnly=False,
+        fields=None,
+    ):
+        """ WORK WITH NOTES """
+        notes = self.iterNotes(
+            self.getNoteFilter(keywords, createOrder, deletedOnly),
+            self.getMetadataSpec(fields),
+            count=count,
+            offset=offset,
+        )
+        return NotesMetadataList(
+            startIndex=offset, totalNotes=notes.totalNotes, notes=list(notes)
+        )
 
     @EdamException
     def loadNoteContent(self, note):
@@ -338,15 +483,28 @@ class GeekNote(object):
 
         note.content = self.getNoteStore().getNoteContent(self.authToken, note.guid)
         # fill the tags in
+        nameCache = self.getNameCache()
         if note.tagGuids and not getattr(note, "tagNames", None):
             note.tagNames = []
             for guid in note.tagGuids:
-                tag = self.getNoteStore().getTag(self.authToken, guid)
-                note.tagNames.append(tag.name)
+                name = nameCache.getName("tags", guid)
+                if name is None:
+                    name = self.getNoteStore().getTag(self.authToken, guid).name
+                note.tagNames.append(name)
 
-        note.notebookName = (
-            self.getNoteStore().getNotebook(self.authToken, note.notebookGuid).name
-        )
+        if not note.notebookGuid:
+            # metadata found without the notebook
+            return
+        note.notebookName = nameCache.getName("notebooks", note.notebookGuid)
+        if note.notebookName is None:
+            note.notebookName = (
+                self.getNoteStore().getNotebook(self.authToken, note.notebookGuid).name
+            )
+
+    @EdamException
+    def getNoteSearchText(self, guid):
+        """ plain text of a note and of the text recognized in its resources """
+        return self.getNoteStore().getNoteSearchText(self.authToken, guid, False, False)
 
     @EdamException
     def loadLinkedNoteContent(self, note):
@@ -434,7 +592,10 @@ class GeekNote(object):
             pass
         logging.debug("New note : %s", note)
 
-        return self.getNoteStore().createNote(self.authToken, note)
+        result = self.getNoteStore().createNote(self.authToken, note)
+        # new tag names create tags on the server
+        self.metadataChanged("tags" if tags else "notes")
+        return result
 
     @EdamException
     def updateNote(
@@ -533,6 +694,7 @@ class GeekNote(object):
 
         if not shared:
             self.getNoteStore().updateNote(self.authToken, note)
+            self.metadataChanged("tags" if tags else "notes")
         else:
             self.sharedNoteStore.updateNote(self.sharedAuthToken, note)
         return True
@@ -542,8 +704,19 @@ class GeekNote(object):
         logging.debug("Delete note with guid: %s", guid)
 
         self.getNoteStore().deleteNote(self.authToken, guid)
+        self.metadataChanged("notes")
         return True
 
+    @EdamException
+    def getSyncState(self):
+        return self.getNoteStore().getSyncState(self.authToken)
+
+    @EdamException
+    def getFilteredSyncChunk(self, afterUSN, maxEntries, syncFilter):
+        return self.getNoteStore().getFilteredSyncChunk(
+            self.authToken, afterUSN, maxEntries, syncFilter
+        )
+
     @EdamException
     def findNotebooks(self):
         """ WORK WITH NOTEBOOKS """
@@ -563,6 +736,7 @@ class GeekNote(object):
         logging.debug("New notebook : %s", notebook)
 
         result = self.getNoteStore().createNotebook(self.authToken, notebook)
+        self.metadataChanged("notebooks")
         return result
 
     @EdamException
@@ -574,6 +748,7 @@ class GeekNote(object):
         logging.debug("Update notebook : %s", notebook)
 
         self.getNoteStore().updateNotebook(self.authToken, notebook)
+        self.metadataChanged("notebooks")
         return True
 
     @EdamException
@@ -581,6 +756,7 @@ class GeekNote(object):
         logging.debug("Delete notebook : %s", guid)
 
         self.getNoteStore().expungeNotebook(self.authToken, guid)
+        self.metadataChanged("notebooks")
         return True
 
     @EdamException
@@ -595,6 +771,7 @@ class GeekNote(object):
         logging.debug("New tag : %s", tag)
 
         result = self.getNoteStore().createTag(self.authToken, tag)
+        self.metadataChanged("tags")
         return result
 
     @EdamException
@@ -606,6 +783,7 @@ class GeekNote(object):
         logging.debug("Update tag : %s", tag)
 
         self.getNoteStore().updateTag(self.authToken, tag)
+        self.metadataChanged("tags")
         return True
 
     @EdamException
@@ -613,6 +791,7 @@ class GeekNote(object):
         logging.debug("Delete tag : %s", guid)
 
         self.getNoteStore().expungeTag(self.authToken, guid)
+        self.metadataChanged("tags")
         return True
 
     @EdamException
@@ -632,6 +811,65 @@ class GeekNote(object):
         return True
 
 
+class NotesIterator(object):
+    """
+    Iterates over the notes of a search without holding all of them.
+    The first page is fetched right away, it tells how many notes there are.
+    While a page is consumed, the next ones are fetched in the worker pool,
+    at most GeekNote.concurrency pages ahead.
+    """
+
+    def __init__(self, geeknote, noteFilter, meta, count, offset):
+        self.geeknote = geeknote
+        self.noteFilter = noteFilter
+        self.meta = meta
+        self.pageSize = config.FIND_PAGE_SIZE
+
+        first = geeknote.findNotesPage(
+            noteFilter, offset, min(count, self.pageSize), meta
+        )
+        self.totalNotes = first.totalNotes
+        self.first = first.notes or []
+        # Evernote api will only return so many notes in one go,
+        # the rest is asked for whilst obeying count rules
+        self.end = offset + min(count, max(first.totalNotes - offset, 0))
+        self.start = offset + len(self.first)
+
+    def __len__(self):
+        return len(self.first) + max(self.end - self.start, 0) if self.first else 0
+
+    def _fetchPage(self, offset, size):
+        # runs in the worker threads, each one has its own note store
+        notes = []
+        while len(notes) < size:
+            page = self.geeknote.findNotesPage(
+                self.noteFilter, offset + len(notes), size - len(notes), self.meta
+            )
+            if not page.notes:
+                break
+            notes += page.notes
+        return notes
+
+    def __iter__(self):
+        for note in self.first:
+            yield note
+        if not self.first:
+            return
+
+        offsets = collections.deque(range(self.start, self.end, self.pageSize))
+        pending = collections.deque()
+        while offsets or pending:
+            while offsets and len(pending) < self.geeknote.concurrency:
+                offset = offsets.popleft()
+                pending.append(
+                    self.geeknote.submit(
+                        self._fetchPage, offset, min(self.pageSize, self.end - offset)
+                    )
+                )
+            for note in pending.popleft().result():
+                yield note
+
+
 class GeekNoteConnector(object):
     evernote = None
     storage = None
@@ -776,6 +1014,15 @@ class User(GeekNoteConnector):
                 "Note extension: %s" % note_ext,
             )
 
+            usage = governor.lastUsage()
+            if usage:
+                settings += (
+                    "API calls this hour: %d of %d budgeted"
+                    % (usage["hourCalls"], usage["budget"]),
+                    "Last command: %s, %d API calls"
+                    % (usage["command"], usage["calls"]),
+                )
+
             user_settings = storage.getUserprops()
 
             if user_settings:
@@ -792,7 +1039,11 @@ class User(GeekNoteConnector):
 
 class Tags(GeekNoteConnector):
     def list(self, guid=None):
-        result = self.getEvernote().findTags()
+        replica = self.getEvernote().getReplica()
+        if replica.isFresh():
+            result = replica.getTags()
+        else:
+            result = self.getEvernote().findTags()
         out.printList(result, showGUID=guid)
 
     def create(self, title):
@@ -838,13 +1089,17 @@ class Tags(GeekNoteConnector):
             return tools.exitErr()
 
     def _searchTag(self, tag):
-        result = self.getEvernote().findTags()
-        tag = [item for item in result if item.name == tag]
-
-        if tag:
-            tag = tag[0]
+        guid = self.getEvernote().getNameCache().getGuid("tags", tag)
+        if guid:
+            tag = Types.Tag(guid=guid, name=tag)
         else:
-            tag = out.SelectSearchResult(result)
+            result = self.getEvernote().findTags()
+            tag = [item for item in result if item.name == tag]
+
+            if tag:
+                tag = tag[0]
+            else:
+                tag = out.SelectSearchResult(result)
 
         logging.debug("Selected tag: %s" % str(tag))
         return tag
@@ -852,8 +1107,13 @@ class Tags(GeekNoteConnector):
 
 class Notebooks(GeekNoteConnector):
     def list(self, guid=None):
-        result = self.getEvernote().findNotebooks()
-        result_linked = self.getEvernote().findLinkedNotebooks()
+        replica = self.getEvernote().getReplica()
+        if replica.isFresh():
+            result = replica.getNotebooks()
+            result_linked = replica.getLinkedNotebooks()
+        else:
+            result = self.getEvernote().findNotebooks()
+            result_linked = self.getEvernote().findLinkedNotebooks()
         out.printList(result, showGUID=guid)
 
         # also show linked notebooks for good measure
@@ -919,13 +1179,17 @@ class Notebooks(GeekNoteConnector):
             return tools.exitErr()
 
     def _searchNotebook(self, notebook):
-        result = self.getEvernote().findNotebooks()
-        notebook = [item for item in result if item.name == notebook]
-
-        if notebook:
-            notebook = notebook[0]
+        guid = self.getEvernote().getNameCache().getGuid("notebooks", notebook)
+        if guid:
+            notebook = Types.Notebook(guid=guid, name=notebook)
         else:
-            notebook = out.SelectSearchResult(result)
+            result = self.getEvernote().findNotebooks()
+            notebook = [item for item in result if item.name == notebook]
+
+            if notebook:
+                notebook = notebook[0]
+            else:
+                notebook = out.SelectSearchResult(result)
 
         logging.debug("Selected notebook: %s" % str(notebook))
         return notebook
@@ -934,12 +1198,7 @@ class Notebooks(GeekNoteConnector):
         if len(notebook) == 36 and notebook.find("-") == 4:
             return notebook
 
-        result = self.getEvernote().findNotebooks()
-        notebook = [item for item in result if item.name == notebook]
-        if notebook:
-            return notebook[0].guid
-        else:
-            return None
+        return self.getEvernote().getNameCache().getGuid("notebooks", notebook)
 
 
 class Notes(GeekNoteConnector):
@@ -1080,9 +1339,9 @@ class Notes(GeekNoteConnector):
             out.failureMessage("Error: could not find specified Linked Notebook")
             return tools.exitErr()
 
-        sharedNoteStoreClient = THttpClient.THttpClient(my_shared_notebook.noteStoreUrl)
-        sharedNoteStoreProtocol = TBinaryProtocol.TBinaryProtocol(sharedNoteStoreClient)
-        sharedNoteStore = NoteStore.Client(sharedNoteStoreProtocol)
+        sharedNoteStore = self.getEvernote().getLinkedNoteStore(
+            my_shared_notebook.noteStoreUrl
+        )
         sharedAuthResult = sharedNoteStore.authenticateToSharedNotebook(
             my_shared_notebook.shareKey, self.getEvernote().authToken
         )
@@ -1117,9 +1376,9 @@ class Notes(GeekNoteConnector):
             out.failureMessage("Error: could not find specified Linked Notebook")
             return tools.exitErr()
 
-        sharedNoteStoreClient = THttpClient.THttpClient(my_shared_notebook.noteStoreUrl)
-        sharedNoteStoreProtocol = TBinaryProtocol.TBinaryProtocol(sharedNoteStoreClient)
-        sharedNoteStore = NoteStore.Client(sharedNoteStoreProtocol)
+        sharedNoteStore = self.getEvernote().getLinkedNoteStore(
+            my_shared_notebook.noteStoreUrl
+        )
         sharedAuthResult = sharedNoteStore.authenticateToSharedNotebook(
             my_shared_notebook.shareKey, self.getEvernote().authToken
         )
@@ -1212,11 +1471,8 @@ class Notes(GeekNoteConnector):
         if note:
             out.preloader.setMessage("Loading note...")
             self.getEvernote().loadNoteContent(note)
-            out.showNote(
-                note,
-                self.getEvernote().getUserInfo().id,
-                self.getEvernote().getUserInfo().shardId,
-            )
+            userId, shardId = self.getEvernote().getUserIds()
+            out.showNote(note, userId, shardId)
 
         if not force and not out.confirm(
             "Are you sure you want to " 'delete this note: "%s"?' % note.title
@@ -1243,11 +1499,8 @@ class Notes(GeekNoteConnector):
         if raw:
             out.showNoteRaw(note)
         else:
-            out.showNote(
-                note,
-                self.getEvernote().getUserInfo().id,
-                self.getEvernote().getUserInfo().shardId,
-            )
+            userId, shardId = self.getEvernote().getUserIds()
+            out.showNote(note, userId, shardId)
 
     def _parseInput(
         self,
@@ -1382,6 +1635,36 @@ class Notes(GeekNoteConnector):
             raise ValueError
         return int((time.mktime(dateStruct) + 1) * 1000)
 
+    def _getDateRange(self, date):
+        """
+        UTC timestamps, in seconds, of the start and the end of a --date value
+        end is None if no end date is given
+        """
+        date = tools.strip(re.split(config.DEF_DATE_RANGE_DELIMITER, date))
+        # Timestamps used by the evernote service will always be in UTC,
+        # per https://discussion.evernote.com/topic/18792-get-timestamp-in-local-time-zone/
+        # (user.timezone refers only to the UI and has no effect on the API)
+        # Here we assume the user is specifying localized time, so we use _getTimeFromDate to
+        # give us the UTC timestamp
+        try:
+            start = self._getTimeFromDate(date[0]) / 1000
+            end = None
+            if len(date) == 2:
+                end = self._getTimeFromDate(date[1]) / 1000 + 60 * 60 * 24
+        except ValueError:
+            out.failureMessage(
+                "Incorrect date format (%s) in --date attribute. "
+                "Format: %s"
+                % (
+                    date,
+                    time.strftime(
+                        config.DEF_DATE_FORMAT, time.strptime("20151231", "%Y%m%d")
+                    ),
+                )
+            )
+            return tools.exitErr()
+        return start, end
+
     def _searchNote(self, note):
         note = tools.strip(note)
 
@@ -1399,9 +1682,13 @@ class Notes(GeekNoteConnector):
             ):
                 note = result.notes[int(note) - 1]
             else:
-                request = self._createSearchRequest(search=note)
-                logging.debug("Search notes: %s" % request)
-                result = self.getEvernote().findNotes(request, 20)
+                result = self._findLocal(search=note, count=20)
+                if result is None:
+                    request = self._createSearchRequest(search=note)
+                    logging.debug("Search notes: %s" % request)
+                    result = self.getEvernote().findNotes(
+                        request, 20, fields=LIST_FIELDS
+                    )
                 logging.debug("Search notes result: %s" % str(result))
                 if result.totalNotes == 0:
                     out.failureMessage("Notes have not been found.")
@@ -1434,8 +1721,26 @@ class Notes(GeekNoteConnector):
         reminders_only=None,
         guid=None,
         deleted_only=None,
+        local=None,
     ):
 
+        if local:
+            return self._findIndexed(
+                search,
+                tag,
+                notebook,
+                date,
+                exact_entry,
+                with_url,
+                with_tags,
+                with_notebook,
+                count,
+                ignore_completed,
+                reminders_only,
+                guid,
+                deleted_only,
+            )
+
         request = self._createSearchRequest(
             search,
             tag,
@@ -1455,39 +1760,177 @@ class Notes(GeekNoteConnector):
         logging.debug("Search count: %s", count)
 
         createFilter = True if search == "*" else False
-        result = self.getEvernote().findNotes(
-            request, count, createFilter, deletedOnly=deleted_only
-        )
+        result = None
+        if not content_search:
+            result = self._findLocal(
+                search,
+                tag,
+                notebook,
+                date,
+                exact_entry,
+                ignore_completed,
+                reminders_only,
+                deleted_only,
+                count,
+                createFilter,
+            )
+        local = result is not None
+        if local:
+            notes = result.notes
+        else:
+            evernote = self.getEvernote()
+            fields = list(LIST_FIELDS)
+            if with_tags:
+                fields.append("tagGuids")
+            if with_notebook:
+                fields.append("notebookGuid")
+            notes = evernote.iterNotes(
+                evernote.getNoteFilter(request, createFilter, deleted_only),
+                evernote.getMetadataSpec(fields),
+                count=count,
+            )
+            result = NotesMetadataList(
+                startIndex=0, totalNotes=notes.totalNotes, notes=[]
+            )
 
         if result.totalNotes == 0:
             out.failureMessage("Notes have not been found.")
             return tools.exitErr()
 
+        if with_notebook:
+            nameCache = self.getEvernote().getNameCache()
+
+        def listNotes():
+            # the first page is printed while the next ones are fetched
+            for note in notes:
+                if with_notebook:
+                    note.notebookName = (
+                        nameCache.getName("notebooks", note.notebookGuid) or ""
+                    )
+                if not local:
+                    result.notes.append(note)
+                yield note
+
+        out.SearchResult(
+            listNotes(),
+            request,
+            total=len(notes),
+            showUrl=with_url,
+            showTags=with_tags,
+            showNotebook=with_notebook,
+            showGUID=guid,
+        )
+
         # save search result
-        # print result
+        storage = self.getStorage()
+        storage.setSearch(result)
+        if not local:
+            for note in result.notes:
+                # don't replace the replica's complete metadata
+                if not storage.getNote(note.guid):
+                    storage.setNote(note)
+
+    def _findIndexed(
+        self,
+        search=None,
+        tags=None,
+        notebook=None,
+        date=None,
+        exact_entry=None,
+        with_url=None,
+        with_tags=None,
+        with_notebook=None,
+        count=None,
+        ignore_completed=None,
+        reminders_only=None,
+        guid=None,
+        deleted_only=None,
+    ):
+        """ find --local: search the full-text index, without calling Evernote """
+        evernote = self.getEvernote()
+        snippets = {}
+        ranked = None
+        if search and search != "*":
+            matches = evernote.getSearchIndex().search(search, exact_entry)
+            if matches is None:
+                out.failureMessage(
+                    "Local search is not available, "
+                    "run 'geeknote sync-metadata --with-content' first."
+                )
+                return tools.exitErr()
+            snippets = dict(matches)
+            ranked = [match[0] for match in matches]
+
+        result = evernote.getReplica().findNotes(
+            None,
+            tags,
+            notebook,
+            self._getDateRange(date) if date else None,
+            exact_entry,
+            reminders_only,
+            ignore_completed,
+            deleted_only,
+            int(count) if count else 20,
+            ranked=ranked,
+        )
+
+        if result.totalNotes == 0:
+            out.failureMessage("Notes have not been found.")
+            return tools.exitErr()
+
         self.getStorage().setSearch(result)
-        for note in result.notes:
-            self.getStorage().setNote(note)
 
-        if with_notebook:
-            noteStore = self.getEvernote().getNoteStore()
-            notebookNameFromGuid = dict()
-            for note in result.notes:
-                if note.notebookGuid not in notebookNameFromGuid:
-                    notebookNameFromGuid[note.notebookGuid] = noteStore.getNotebook(
-                        self.getEvernote().authToken, note.notebookGuid
-                    ).name
-                note.notebookName = notebookNameFromGuid[note.notebookGuid]
+        notebookNames = self.getStorage().getNotebooks() or {}
+        for note in result.notes:
+            note.snippet = snippets.get(note.guid)
+            note.notebookName = notebookNames.get(note.notebookGuid, "")
 
         out.SearchResult(
             result.notes,
-            request,
+            "local: %s" % (search or "*"),
             showUrl=with_url,
             showTags=with_tags,
             showNotebook=with_notebook,
             showGUID=guid,
         )
 
+    def _findLocal(
+        self,
+        search=None,
+        tags=None,
+        notebook=None,
+        date=None,
+        exact_entry=None,
+        ignore_completed=None,
+        reminders_only=None,
+        deleted_only=None,
+        count=20,
+        createOrder=False,
+    ):
+        """
+        Search the metadata replica instead of the server
+        returns None if the replica is out of date or can't answer the search
+        """
+        replica = self.getEvernote().getReplica()
+        if not replica.isFresh():
+            return None
+
+        result = replica.findNotes(
+            search,
+            tags,
+            notebook,
+            self._getDateRange(date) if date else None,
+            exact_entry or self.findExactOnUpdate,
+            reminders_only,
+            ignore_completed,
+            deleted_only,
+            count,
+            createOrder,
+        )
+        if result is not None:
+            logging.debug("Search notes in the local replica: %s", result.totalNotes)
+        return result
+
     def dedup(self, notebook=None):
         logging.debug("Retrieving note metadata")
 
@@ -1495,14 +1938,25 @@ class Notes(GeekNoteConnector):
         logging.debug(request)
         evernote = self.getEvernote()
         out.preloader.setMessage("Retrieving metadata...")
-        result = evernote.findNotes(request, EDAM_USER_NOTES_MAX, False, 0)
-        notes = result.notes
+        notes = evernote.iterNotes(
+            evernote.getNoteFilter(request),
+            evernote.getMetadataSpec(
+                [
+                    "title",
+                    "contentLength",
+                    "created",
+                    "largestResourceMime",
+                    "largestResourceSize",
+                ]
+            ),
+        )
 
         logging.debug(
-            "First pass, comparing metadata of " + str(len(result.notes)) + " notes"
+            "First pass, comparing metadata of " + str(notes.totalNotes) + " notes"
         )
         notes_dict = {}
 
+        # notes are compared while the next pages are fetched
         for note in notes:
             # Use note title, contentLength and resource descriptors
             # as the best "unique" key we can make out of the metadata.
@@ -1549,10 +2003,12 @@ class Notes(GeekNoteConnector):
             + " notes"
         )
         notes_dict = {}
+        out.preloader.setMessage("Retrieving content...")
+        # content is fetched concurrently, notes are compared in order
+        dup_notes = [note for dup_group in all_dups for note in dup_group]
+        list(evernote.map(evernote.loadNoteContent, dup_notes))
         for dup_group in all_dups:
             for note in dup_group:
-                out.preloader.setMessage("Retrieving content...")
-                self.getEvernote().loadNoteContent(note)
                 md5 = hashlib.md5()
                 md5.update(note.content)
                 noteId = md5.hexdigest() + " " + note.title
@@ -1607,7 +2063,7 @@ class Notes(GeekNoteConnector):
             "Removed "
             + str(removed_count)
             + " duplicates within "
-            + str(len(result.notes))
+            + str(notes.totalNotes)
             + " total notes"
         )
 
@@ -1650,35 +2106,14 @@ class Notes(GeekNoteConnector):
                 request += _formatExpression("tag", tag)
 
         if date:
-            date = tools.strip(re.split(config.DEF_DATE_RANGE_DELIMITER, date))
-            # Timestamps used by the evernote service will always be in UTC,
-            # per https://discussion.evernote.com/topic/18792-get-timestamp-in-local-time-zone/
-            # (user.timezone refers only to the UI and has no effect on the API)
-            # Here we assume the user is specifying localized time, so we use _getTimeFromDate to
-            # give us the UTC timestamp
-            try:
-                request += "created:%s " % time.strftime(
-                    "%Y%m%dT%H%M00Z", time.gmtime(self._getTimeFromDate(date[0]) / 1000)
-                )
-                if len(date) == 2:
-                    request += "-created:%s " % time.strftime(
-                        "%Y%m%dT%H%M00Z",
-                        time.gmtime(
-                            self._getTimeFromDate(date[1]) / 1000 + 60 * 60 * 24
-                        ),
-                    )
-            except ValueError:
-                out.failureMessage(
-                    "Incorrect date format (%s) in --date attribute. "
-                    "Format: %s"
-                    % (
-                        date,
-                        time.strftime(
-                            config.DEF_DATE_FORMAT, time.strptime("20151231", "%Y%m%d")
-                        ),
-                    )
+            start, end = self._getDateRange(date)
+            request += "created:%s " % time.strftime(
+                "%Y%m%dT%H%M00Z", time.gmtime(start)
+            )
+            if end is not None:
+                request += "-created:%s " % time.strftime(
+                    "%Y%m%dT%H%M00Z", time.gmtime(end)
                 )
-                return tools.exitErr()
 
         if search:
             search = tools.strip(search)
@@ -1699,9 +2134,40 @@ class Notes(GeekNoteConnector):
         return request
 
 
+class Metadata(GeekNoteConnector):
+    def sync(self, full=None, with_content=None):
+        out.preloader.setMessage("Synchronizing metadata...")
+        result = self.getEvernote().getReplica().sync(full=full)
+        out.successMessage(
+            "Metadata synchronized up to USN %d: %d notes, %d notebooks "
+            "and %d tags updated, %d items removed."
+            % (
+                result["usn"],
+                result["notes"],
+                result["notebooks"],
+                result["tags"],
+                result["expunged"],
+            )
+        )
+
+        if with_content:
+            out.preloader.setMessage("Indexing note contents...")
+            try:
+                result = self.getEvernote().getSearchIndex().update()
+            except Exception as e:
+                out.failureMessage("Error: %s" % e)
+                return tools.exitErr()
+            out.successMessage(
+                "Search index updated: %d notes indexed, %d removed."
+                % (result["indexed"] + result["renamed"], result["removed"])
+            )
+
+
 def main(args=None):
     os.environ["TMP"] = "/tmp"
     os.environ["TEMP"] = "/tmp"
+    COMMAND = None
+    showStats = False
     try:
         exit_status_code = 0
 
@@ -1711,6 +2177,10 @@ def main(args=None):
 
         sys_argv = tools.decodeArgs(sys_argv)
 
+        # --stats may be given to any command
+        showStats = "--stats" in sys_argv
+        sys_argv = [arg for arg in sys_argv if arg != "--stats"]
+
         COMMAND = sys_argv[0] if len(sys_argv) >= 1 else None
 
         aparser = argparser(sys_argv)
@@ -1765,6 +2235,9 @@ def main(args=None):
         if COMMAND == "dedup":
             Notes().dedup(**ARGS)
 
+        if COMMAND == "sync-metadata":
+            Metadata().sync(**ARGS)
+
         # Notebooks
         if COMMAND == "notebook-list":
             Notebooks().list(**ARGS)
@@ -1798,6 +2271,14 @@ def main(args=None):
         traceback.print_exc()
         logging.error("App error: %s", str(e))
 
+    if governor.calls:
+        governor.report(COMMAND)
+
+    if stats.calls:
+        stats.dump(os.path.join(config.APP_DIR, "stats.json"), COMMAND)
+        if showStats:
+            out.printLine("\n".join(stats.report()))
+
     # exit preloader
     tools.exit("exit", exit_status_code)
 
@@ -12,19 +12,18 @@ import binascii
 import mimetypes
 
 import evernote2.edam.type.ttypes as Types
-from evernote2.edam.limits.constants import EDAM_USER_NOTES_MAX
 from bs4 import BeautifulSoup
 
 from . import config
 from .geeknote import GeekNote
 from .storage import Storage
 from .editor import Editor
+from .ratelimit import governor
+from .stats import stats
 from . import tools
 
 # for prototyping...
 # refactor should move code depending on these modules elsewhere
-import thrift.protocol.TBinaryProtocol as TBinaryProtocol
-import thrift.transport.THttpClient as THttpClient
 import urllib.parse
 import evernote2.edam.notestore.NoteStore as NoteStore
 
@@ -105,6 +104,7 @@ class GNSync:
     notebook_guid = None
     all_set = False
     sleep_on_ratelimit = False
+    geeknote = None
 
     @log
     def __init__(
@@ -154,6 +154,7 @@ class GNSync:
         self.twoway = twoway
         self.download_only = download_only
         self.nodownsync = nodownsync
+        self.sleep_on_ratelimit = sleep_on_ratelimit
 
         logger.info("Sync Start")
 
@@ -166,7 +167,13 @@ class GNSync:
         # all is Ok
         self.all_set = True
 
-        self.sleep_on_ratelimit = sleep_on_ratelimit
+    def _geeknote(self):
+        """
+        GeekNote client shared by all calls of this sync
+        """
+        if self.geeknote is None:
+            self.geeknote = GeekNote(sleepOnRateLimit=self.sleep_on_ratelimit)
+        return self.geeknote
 
     @log
     def sync(self):
@@ -182,6 +189,11 @@ class GNSync:
         notes = self._get_notes()
 
         if not self.download_only:
+            notes = list(notes)
+            notesByTitle = {}
+            for n in notes:
+                notesByTitle.setdefault(n.title, []).append(n)
+
             for f in files:
                 has_note = False
                 meta = self._parse_meta(self._get_file_content(f["path"]))
@@ -200,40 +212,51 @@ class GNSync:
                     meta["mtime"] = f["mtime"]
                     note = self._html2note(meta)
 
-                for n in notes:
-                    if title == n.title:
-                        has_note = True
-                        if f["mtime"] > n.updated:
-                            if self.format == "html":
-                                gn = GeekNote(sleepOnRateLimit=self.sleep_on_ratelimit)
-                                note.guid = n.guid
-                                gn.getNoteStore().updateNote(gn.authToken, note)
-                                logger.info('Note "{0}" was updated'.format(note.title))
-                            else:
-                                self._update_note(f, n, title, meta["content"], tags)
-                            break
+                for n in notesByTitle.get(title, []):
+                    has_note = True
+                    if f["mtime"] > n.updated:
+                        if self.format == "html":
+                            gn = self._geeknote()
+                            note.guid = n.guid
+                            gn.getNoteStore().updateNote(gn.authToken, note)
+                            logger.info('Note "{0}" was updated'.format(note.title))
+                        else:
+                            self._update_note(f, n, title, meta["content"], tags)
+                        break
 
                 if not has_note:
                     if self.format == "html":
-                        gn = GeekNote(sleepOnRateLimit=self.sleep_on_ratelimit)
+                        gn = self._geeknote()
                         gn.getNoteStore().createNote(gn.authToken, note)
                         logger.info('Note "{0}" was created'.format(note.title))
                     else:
                         self._create_note(f, title, meta["content"], tags)
 
         if self.twoway or self.download_only:
-            for n in notes:
-                has_file = False
-                for f in files:
-                    if f["name"] == n.title:
+            filesByName = {}
+            for f in files:
+                filesByName.setdefault(f["name"], []).append(f)
+
+            def downloads():
+                for n in notes:
+                    has_file = False
+                    for f in filesByName.get(n.title, []):
                         has_file = True
                         if f["mtime"] < n.updated:
-                            self._update_file(f, n)
+                            yield (self._update_file, f, n)
                             break
 
-                if not self.nodownsync:
-                    if not has_file:
-                        self._create_file(n)
+                    if not self.nodownsync:
+                        if not has_file:
+                            yield (self._create_file, n)
+
+            # notes are independent of each other, download them concurrently;
+            # with --download-only they start while the next pages are fetched
+            list(
+                self._geeknote().map(
+                    lambda download: download[0](*download[1:]), downloads()
+                )
+            )
 
         logger.info("Sync Complete")
 
@@ -317,7 +340,7 @@ class GNSync:
         except AttributeError:
             tags = None
 
-        result = GeekNote(sleepOnRateLimit=self.sleep_on_ratelimit).updateNote(
+        result = self._geeknote().updateNote(
             guid=note.guid,
             title=title or note.title,
             content=content or self._get_file_content(file_note["path"]),
@@ -337,7 +360,7 @@ class GNSync:
         """
         Updates file from note
         """
-        GeekNote(sleepOnRateLimit=self.sleep_on_ratelimit).loadNoteContent(note)
+        self._geeknote().loadNoteContent(note)
         content = Editor.ENMLtoText(note.content)
         open(file_note["path"], "w").write(content)
         updated_seconds = note.updated / 1000.0
@@ -354,7 +377,7 @@ class GNSync:
         if content is None:
             return
 
-        result = GeekNote(sleepOnRateLimit=self.sleep_on_ratelimit).createNote(
+        result = self._geeknote().createNote(
             title=title or file_note["name"],
             content=content,
             notebook=self.notebook_guid,
@@ -376,17 +399,19 @@ class GNSync:
         """
         Creates file from note
         """
-        GeekNote(sleepOnRateLimit=self.sleep_on_ratelimit).loadNoteContent(note)
+        self._geeknote().loadNoteContent(note)
 
         escaped_title = re.sub(os.sep, "-", note.title)
+        # notes are saved concurrently, keep per-note options apart
+        imageOptions = dict(self.imageOptions)
 
         # Save images
-        if "saveImages" in self.imageOptions and self.imageOptions["saveImages"]:
+        if "saveImages" in imageOptions and imageOptions["saveImages"]:
             imageList = Editor.getImages(note.content)
             if imageList:
                 if (
-                    "imagesInSubdir" in self.imageOptions
-                    and self.imageOptions["imagesInSubdir"]
+                    "imagesInSubdir" in imageOptions
+                    and imageOptions["imagesInSubdir"]
                 ):
                     try:
                         os.mkdir(os.path.join(self.path, escaped_title + "_images"))
@@ -396,24 +421,24 @@ class GNSync:
                     imagePath = os.path.join(
                         self.path, escaped_title + "_images", escaped_title
                     )
-                    self.imageOptions["baseFilename"] = (
+                    imageOptions["baseFilename"] = (
                         escaped_title + "_images/" + escaped_title
                     )
                 else:
                     imagePath = os.path.join(self.path, escaped_title)
-                    self.imageOptions["baseFilename"] = escaped_title
+                    imageOptions["baseFilename"] = escaped_title
                 for imageInfo in imageList:
                     filename = "{}-{}.{}".format(
                         imagePath, imageInfo["hash"], imageInfo["extension"]
                     )
                     logger.info("Saving image to {}".format(filename))
                     binaryHash = binascii.unhexlify(imageInfo["hash"])
-                    if not GeekNote(sleepOnRateLimit=self.sleep_on_ratelimit).saveMedia(
+                    if not self._geeknote().saveMedia(
                         note.guid, binaryHash, filename
                     ):
                         logger.warning("Failed to save image {}".format(filename))
 
-        content = Editor.ENMLtoText(note.content, self.imageOptions)
+        content = Editor.ENMLtoText(note.content, imageOptions)
         path = os.path.join(self.path, escaped_title + self.extension)
         open(path, "w").write(content)
         updated_seconds = note.updated / 1000.0
@@ -444,7 +469,7 @@ class GNSync:
         Get notebook guid and name.
         Takes default notebook if notebook's name does not select.
         """
-        notebooks = GeekNote(sleepOnRateLimit=self.sleep_on_ratelimit).findNotebooks()
+        notebooks = self._geeknote().findNotebooks()
 
         if not notebook_name:
             notebook_name = os.path.basename(os.path.realpath(path))
@@ -455,9 +480,7 @@ class GNSync:
             guid = notebook[0].guid
 
         if not guid:
-            notebook = GeekNote(
-                sleepOnRateLimit=self.sleep_on_ratelimit
-            ).createNotebook(notebook_name)
+            notebook = self._geeknote().createNotebook(notebook_name)
 
             if notebook:
                 logger.info('Notebook "{0}" was' " created".format(notebook_name))
@@ -498,14 +521,15 @@ class GNSync:
         keywords = 'notebook:"{0}"'.format(
             tools.strip(self.notebook_name.encode("utf-8"))
         )
-        return (
-            GeekNote(sleepOnRateLimit=self.sleep_on_ratelimit)
-            .findNotes(keywords, EDAM_USER_NOTES_MAX)
-            .notes
+        geeknote = self._geeknote()
+        return geeknote.iterNotes(
+            geeknote.getNoteFilter(keywords),
+            geeknote.getMetadataSpec(["title", "updated"]),
         )
 
 
 def main():
+    showStats = False
     try:
         parser = argparse.ArgumentParser()
         parser.add_argument(
@@ -579,8 +603,14 @@ def main():
             action="store_true",
             help="save images in a subdirectory (instead of same directory as file)",
         )
+        parser.add_argument(
+            "--stats",
+            action="store_true",
+            help="show the count, latency and size of the API calls made",
+        )
 
         args = parser.parse_args()
+        showStats = args.stats
 
         path = args.path if args.path else "."
         mask = args.mask if args.mask else None
@@ -605,11 +635,7 @@ def main():
             for notebook in all_linked_notebooks():
                 print("Syncing notebook: " + notebook.shareName)
                 notebook_url = urllib.parse.urlparse(notebook.noteStoreUrl)
-                sharedNoteStoreClient = THttpClient.THttpClient(notebook.noteStoreUrl)
-                sharedNoteStoreProtocol = TBinaryProtocol.TBinaryProtocol(
-                    sharedNoteStoreClient
-                )
-                sharedNoteStore = NoteStore.Client(sharedNoteStoreProtocol)
+                sharedNoteStore = geeknote.getLinkedNoteStore(notebook.noteStoreUrl)
 
                 sharedAuthResult = sharedNoteStore.authenticateToSharedNotebook(
                     notebook.shareKey, geeknote.authToken
@@ -680,6 +706,21 @@ def main():
     except Exception as e:
         logger.error(str(e))
 
+    if governor.calls:
+        usage = governor.report("gnsync")
+        logger.info(
+            "%d API calls, %d of %d budgeted calls used this hour",
+            usage["calls"],
+            usage["hourCalls"],
+            usage["budget"],
+        )
+
+    if stats.calls:
+        stats.dump(os.path.join(config.APP_DIR, "stats.json"), "gnsync")
+        if showStats:
+            for line in stats.report():
+                logger.info(line)
+
 
 if __name__ == "__main__":
     main()
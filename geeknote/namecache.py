@@ -0,0 +1,95 @@
+"""
+GUID <-> name maps of tags and notebooks, kept in the local database
+"""
+
+import threading
+
+from .log import logging
+
+
+class NameCache(object):
+    """
+    Resolves tag and notebook names without a call per GUID.
+    Each map is filled with one listTags/listNotebooks call and stored with
+    Storage.setTags/setNotebooks together with the account's update count
+    (USN). A later process reuses the stored map while the USN is unchanged.
+    """
+
+    KINDS = ("tags", "notebooks")
+
+    def __init__(self, geeknote):
+        self.geeknote = geeknote
+        self.names = {}
+        self.refreshed = set()
+        self.updateCount = None
+        self.lock = threading.RLock()
+
+    def _getUpdateCount(self):
+        if self.updateCount is None:
+            self.updateCount = self.geeknote.getSyncState().updateCount
+        return self.updateCount
+
+    def _fetch(self, kind):
+        storage = self.geeknote.getStorage()
+        if kind == "tags":
+            names = dict((tag.guid, tag.name) for tag in self.geeknote.findTags())
+            storage.setTags(names)
+        else:
+            names = dict(
+                (notebook.guid, notebook.name)
+                for notebook in self.geeknote.findNotebooks()
+            )
+            storage.setNotebooks(names)
+        storage.setCache(kind + "USN", self._getUpdateCount())
+        logging.debug("Fetched %d %s", len(names), kind)
+        return names
+
+    def _load(self, kind):
+        with self.lock:
+            if kind not in self.names:
+                storage = self.geeknote.getStorage()
+                if storage.getCache(kind + "USN") == self._getUpdateCount():
+                    if kind == "tags":
+                        self.names[kind] = storage.getTags() or {}
+                    else:
+                        self.names[kind] = storage.getNotebooks() or {}
+                else:
+                    self.names[kind] = self._fetch(kind)
+            return self.names[kind]
+
+    def getNames(self, kind):
+        """ returns a {guid: name} dict of all tags or notebooks """
+        return self._load(kind)
+
+    def getName(self, kind, guid):
+        """
+        Get the name of a tag or notebook by GUID
+        The map is fetched again once if the GUID is unknown
+        """
+        names = self._load(kind)
+        if guid not in names:
+            with self.lock:
+                if kind not in self.refreshed:
+                    self.refreshed.add(kind)
+                    self.updateCount = None
+                    self.names[kind] = names = self._fetch(kind)
+        return names.get(guid)
+
+    def getGuid(self, kind, name):
+        """
+        Get the GUID of a tag or notebook by name
+        returns None if there is no such tag or notebook
+        """
+        for guid, itemName in self._load(kind).items():
+            if itemName == name:
+                return guid
+        return None
+
+    def invalidate(self, kind=None):
+        """ Drop the cached map(s), e.g. after a tag or notebook has been changed """
+        with self.lock:
+            for kind in [kind] if kind else self.KINDS:
+                self.names.pop(kind, None)
+                self.refreshed.discard(kind)
+                self.geeknote.getStorage().setCache(kind + "USN", None)
+            self.updateCount = None
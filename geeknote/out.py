@@ -292,12 +292,17 @@ def printList(
     showTags=False,
     showNotebook=False,
     showGUID=False,
+    total=None,
 ):
+    """
+    listItems may be any iterable if total gives the number of items
+    """
 
     if title:
         separator("=", title)
 
-    total = len(listItems)
+    if total is None:
+        total = len(listItems)
     printLine("Found %d item%s" % (total, ("s" if total != 1 else "")))
     for key, item in enumerate(listItems):
         key += 1
@@ -330,6 +335,8 @@ def printList(
                 else "",
             )
         )
+        if getattr(item, "snippet", None):
+            printLine("      %s" % item.snippet)
 
         if showByStep != 0 and key % showByStep == 0 and key < total:
             printLine("-- More --", "\r")
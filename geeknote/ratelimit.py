@@ -0,0 +1,183 @@
+"""
+Rate-limit governor shared by all threads and all geeknote/gnsync processes
+"""
+
+import json
+import os
+import threading
+import time
+
+from evernote2.edam.error.ttypes import EDAMErrorCode, EDAMSystemException
+
+from . import config
+from .log import logging
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+class RateLimiter(object):
+    """
+    Token bucket which throttles outgoing API calls before the server does.
+    The deadline sent by the server with errorCode 19 (rateLimitDuration)
+    and the calls made during the current hour are kept in a file-locked
+    state file, so concurrent processes back off together.
+    """
+
+    def __init__(self, path, rate, burst, budget):
+        self.path = path
+        self.rate = float(rate)
+        self.burst = burst
+        self.budget = budget
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+        # usage of this process
+        self.calls = 0
+        self.hits = 0
+
+    def _state(self, update=None):
+        """
+        Read the shared state, `update` may change it while the file is locked
+        """
+        with open(self.path, "a+") as f:
+            if fcntl:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                f.seek(0)
+                try:
+                    state = json.loads(f.read() or "{}")
+                except ValueError:
+                    state = {}
+
+                if update:
+                    update(state)
+                    f.seek(0)
+                    f.truncate()
+                    f.write(json.dumps(state))
+                return state
+            finally:
+                if fcntl:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    @staticmethod
+    def _countCall(state):
+        window = int(time.time() // 3600)
+        if state.get("window") != window:
+            state["window"] = window
+            state["calls"] = 0
+        state["calls"] += 1
+
+    def remaining(self):
+        """
+        Seconds left until the server accepts calls again, 0 if not limited
+        """
+        return max(self._state().get("deadline", 0) - time.time(), 0)
+
+    def acquire(self):
+        """
+        Take a token before a call, waiting if the bucket is empty
+        Raises the server's rate limit error while its deadline lasts
+        """
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(
+                self.burst, self.tokens + (now - self.updated) * self.rate
+            )
+            self.updated = now
+            self.tokens -= 1
+            delay = -self.tokens / self.rate if self.tokens < 0 else 0
+
+        if delay:
+            time.sleep(delay)
+
+        now = time.time()
+
+        def update(state):
+            if state.get("deadline", 0) <= now:
+                self._countCall(state)
+
+        remaining = self._state(update).get("deadline", 0) - now
+        if remaining > 0:
+            raise EDAMSystemException(
+                errorCode=EDAMErrorCode.RATE_LIMIT_REACHED,
+                message="Rate limit deadline has not passed yet",
+                rateLimitDuration=int(remaining) + 1,
+            )
+
+        with self.lock:
+            self.calls += 1
+
+    def backoff(self, duration):
+        """
+        Remember the server's rate limit, no process calls it for `duration` seconds
+        """
+        deadline = time.time() + duration
+
+        def update(state):
+            state["deadline"] = max(state.get("deadline", 0), deadline)
+
+        with self.lock:
+            self.hits += 1
+        self._state(update)
+        logging.warning("Rate limit hit, backing off for %s seconds", duration)
+
+    def wait(self):
+        """ Sleep until the server's rate limit is over """
+        remaining = self.remaining()
+        if remaining > 0:
+            time.sleep(remaining)
+
+    def report(self, command):
+        """
+        Record the calls `command` made in this process
+        returns a dict with the usage of the command and of the current hour
+        """
+        usage = {
+            "command": command,
+            "calls": self.calls,
+            "rateLimitHits": self.hits,
+            "budget": self.budget,
+        }
+
+        def update(state):
+            if state.get("window") != int(time.time() // 3600):
+                state["window"] = int(time.time() // 3600)
+                state["calls"] = 0
+            state["lastCommand"] = usage
+
+        state = self._state(update)
+        usage["hourCalls"] = state["calls"]
+        logging.debug(
+            "%s made %d API calls, %d of %d budgeted calls used this hour",
+            command,
+            self.calls,
+            usage["hourCalls"],
+            self.budget,
+        )
+        return usage
+
+    def lastUsage(self):
+        """
+        returns the usage recorded by the last command and the current hour
+        """
+        state = self._state()
+        usage = state.get("lastCommand")
+        if usage is None:
+            return None
+        usage = dict(usage)
+        if state.get("window") == int(time.time() // 3600):
+            usage["hourCalls"] = state.get("calls", 0)
+        else:
+            usage["hourCalls"] = 0
+        return usage
+
+
+governor = RateLimiter(
+    os.path.join(config.APP_DIR, "ratelimit.json"),
+    config.RATE_LIMIT_RATE,
+    config.RATE_LIMIT_BURST,
+    config.RATE_LIMIT_BUDGET,
+)
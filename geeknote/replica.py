@@ -0,0 +1,333 @@
+"""
+Local replica of the account's note, notebook and tag metadata,
+kept up to date with Evernote's incremental sync protocol
+"""
+
+import re
+
+from evernote2.edam.notestore.ttypes import (
+    NoteMetadata,
+    NotesMetadataList,
+    SyncChunkFilter,
+)
+import evernote2.edam.type.ttypes as Types
+
+from . import config
+from . import tools
+from .log import logging
+
+
+SYNC_FILTER = SyncChunkFilter(
+    includeNotes=True,
+    includeNoteResources=True,
+    includeNoteAttributes=True,
+    includeNotebooks=True,
+    includeTags=True,
+    includeLinkedNotebooks=True,
+    includeExpunged=True,
+)
+
+# NoteSortOrder name -> NoteMetadata field
+SORT_FIELDS = {
+    "CREATED": "created",
+    "UPDATED": "updated",
+    "RELEVANCE": "updated",
+    "UPDATE_SEQUENCE_NUMBER": "updateSequenceNum",
+    "TITLE": "title",
+}
+
+
+def toMetadata(note):
+    """ NoteMetadata of a note from a sync chunk, as findNotesMetadata returns it """
+    largest = None
+    for resource in note.resources or []:
+        if resource.data and (
+            largest is None or (resource.data.size or 0) > largest.data.size
+        ):
+            largest = resource
+
+    return NoteMetadata(
+        guid=note.guid,
+        title=note.title,
+        contentLength=note.contentLength,
+        created=note.created,
+        updated=note.updated,
+        deleted=note.deleted,
+        updateSequenceNum=note.updateSequenceNum,
+        notebookGuid=note.notebookGuid,
+        tagGuids=note.tagGuids,
+        attributes=note.attributes,
+        largestResourceMime=largest.mime if largest else None,
+        largestResourceSize=largest.data.size if largest else None,
+    )
+
+
+class Replica(object):
+    """
+    Note, notebook and tag metadata of the account in the local database.
+    sync() asks getFilteredSyncChunk for everything changed after the last
+    stored update count (USN), so only the first sync downloads all of it.
+    """
+
+    def __init__(self, geeknote):
+        self.geeknote = geeknote
+
+    def sync(self, full=False):
+        """
+        Bring the replica up to date, from scratch if full is set
+        or if the server asks for a full sync
+        returns a dict with the number of changed items
+        """
+        storage = self.geeknote.getStorage()
+        state = self.geeknote.getSyncState()
+        usn = storage.getCache("replicaUSN")
+        syncTime = storage.getCache("replicaSyncTime")
+
+        linkedNotebooks = storage.getCache("replicaLinkedNotebooks") or {}
+        if full or usn is None or (syncTime or 0) < (state.fullSyncBefore or 0):
+            logging.debug("Full metadata sync")
+            storage.clearMetadata()
+            storage.setCache("replicaSyncTime", state.currentTime)
+            linkedNotebooks = {}
+            usn = 0
+
+        counts = {"notes": 0, "notebooks": 0, "tags": 0, "expunged": 0}
+        while usn < state.updateCount:
+            chunk = self.geeknote.getFilteredSyncChunk(
+                usn, config.REPLICA_CHUNK_SIZE, SYNC_FILTER
+            )
+            notes = [toMetadata(note) for note in chunk.notes or []]
+            notebooks = dict(
+                (notebook.guid, notebook.name) for notebook in chunk.notebooks or []
+            )
+            tags = dict((tag.guid, tag.name) for tag in chunk.tags or [])
+            storage.saveSyncChunk(
+                notes,
+                notebooks,
+                tags,
+                chunk.expungedNotes or [],
+                chunk.expungedNotebooks or [],
+                chunk.expungedTags or [],
+            )
+
+            for notebook in chunk.linkedNotebooks or []:
+                linkedNotebooks[notebook.guid] = notebook
+            for guid in chunk.expungedLinkedNotebooks or []:
+                linkedNotebooks.pop(guid, None)
+
+            counts["notes"] += len(notes)
+            counts["notebooks"] += len(notebooks)
+            counts["tags"] += len(tags)
+            counts["expunged"] += sum(
+                len(items or [])
+                for items in (
+                    chunk.expungedNotes,
+                    chunk.expungedNotebooks,
+                    chunk.expungedTags,
+                    chunk.expungedLinkedNotebooks,
+                )
+            )
+
+            if chunk.chunkHighUSN is None:
+                usn = chunk.updateCount
+            else:
+                usn = chunk.chunkHighUSN
+            # an interrupted sync goes on from here next time
+            storage.setCache("replicaLinkedNotebooks", linkedNotebooks)
+            storage.setCache("replicaUSN", usn)
+            logging.debug("Synced metadata up to USN %s of %s", usn, chunk.updateCount)
+            state.updateCount = max(state.updateCount, chunk.updateCount)
+
+        storage.setCache("replicaUSN", usn)
+        storage.setCache("replicaChecked", usn)
+        # the tags and notebooks tables are complete now
+        nameCache = self.geeknote.getNameCache()
+        nameCache.invalidate()
+        for kind in nameCache.KINDS:
+            storage.setCache(kind + "USN", usn)
+
+        counts["usn"] = usn
+        return counts
+
+    def isFresh(self):
+        """
+        True if the replica holds the current state of the account.
+        A replica checked less than REPLICA_MAX_AGE seconds ago is trusted,
+        otherwise its update count is compared with the server's.
+        """
+        storage = self.geeknote.getStorage()
+        usn = storage.getCache("replicaUSN")
+        if usn is None:
+            return False
+        if storage.getCache("replicaChecked", config.REPLICA_MAX_AGE) == usn:
+            return True
+        if self.geeknote.getSyncState().updateCount != usn:
+            logging.debug("Metadata replica is out of date")
+            return False
+        storage.setCache("replicaChecked", usn)
+        return True
+
+    def invalidate(self):
+        """ Check the update count before the next use, e.g. after a change """
+        self.geeknote.getStorage().setCache("replicaChecked", None)
+
+    def getNotebooks(self):
+        notebooks = self.geeknote.getStorage().getNotebooks() or {}
+        return sorted(
+            [Types.Notebook(guid=guid, name=name) for guid, name in notebooks.items()],
+            key=lambda notebook: notebook.name.lower(),
+        )
+
+    def getLinkedNotebooks(self):
+        notebooks = self.geeknote.getStorage().getCache("replicaLinkedNotebooks")
+        return sorted(
+            (notebooks or {}).values(),
+            key=lambda notebook: (notebook.shareName or "").lower(),
+        )
+
+    def getTags(self):
+        tags = self.geeknote.getStorage().getTags() or {}
+        return sorted(
+            [Types.Tag(guid=guid, name=name) for guid, name in tags.items()],
+            key=lambda tag: tag.name.lower(),
+        )
+
+    @staticmethod
+    def _matchName(names, value):
+        """
+        GUIDs of the items named `value`, ignoring case;
+        a trailing * matches any name starting with value
+        """
+        value = value.lower()
+        if value.endswith("*"):
+            value = value.rstrip("*")
+            return set(
+                guid for guid, name in names.items() if name.lower().startswith(value)
+            )
+        return set(guid for guid, name in names.items() if name.lower() == value)
+
+    @staticmethod
+    def _splitNegation(values):
+        """ split ["a", "-b"] in (["a"], ["b"]) """
+        wanted, unwanted = [], []
+        for value in values:
+            if value.startswith("-"):
+                unwanted.append(tools.strip(value[1:]))
+            else:
+                wanted.append(tools.strip(value))
+        return wanted, unwanted
+
+    @staticmethod
+    def _matchTitle(title, search, exact):
+        title = (title or "").lower()
+        search = search.lower()
+        if exact:
+            return search in title
+        search = search.rstrip("*")
+        if re.search(r"\W", search):
+            return search in title
+        return any(word.startswith(search) for word in re.split(r"\W+", title))
+
+    def findNotes(
+        self,
+        search=None,
+        tags=None,
+        notebook=None,
+        dateRange=None,
+        exact=False,
+        remindersOnly=False,
+        ignoreCompleted=False,
+        deletedOnly=False,
+        count=20,
+        createOrder=False,
+        ranked=None,
+    ):
+        """
+        Search the replica like GeekNote.findNotes searches the server,
+        search is matched against note titles.
+        ranked limits the result to a list of GUIDs, returned in that order
+        returns a NotesMetadataList
+        returns None if the search can't be answered locally
+        """
+        if search == "*":
+            search = None
+        if search:
+            search = tools.strip(search)
+            # several words are matched against the content by the server
+            if not exact and len(search.split()) > 1:
+                return None
+
+        storage = self.geeknote.getStorage()
+        checks = []
+
+        if search:
+            checks.append(lambda note: self._matchTitle(note.title, search, exact))
+
+        if ranked is not None:
+            rank = dict((guid, index) for index, guid in enumerate(ranked))
+            checks.append(lambda note: note.guid in rank)
+
+        if deletedOnly:
+            checks.append(lambda note: note.deleted)
+        else:
+            checks.append(lambda note: not note.deleted)
+
+        if notebook:
+            wanted, unwanted = self._splitNegation([notebook])
+            names = storage.getNotebooks() or {}
+            for value in wanted:
+                guids = self._matchName(names, value)
+                checks.append(lambda note, guids=guids: note.notebookGuid in guids)
+            for value in unwanted:
+                guids = self._matchName(names, value)
+                checks.append(lambda note, guids=guids: note.notebookGuid not in guids)
+
+        if tags:
+            wanted, unwanted = self._splitNegation(tags)
+            names = storage.getTags() or {}
+            for value in wanted:
+                guids = self._matchName(names, value)
+                checks.append(
+                    lambda note, guids=guids: guids.intersection(note.tagGuids or [])
+                )
+            for value in unwanted:
+                guids = self._matchName(names, value)
+                checks.append(
+                    lambda note, guids=guids: not guids.intersection(
+                        note.tagGuids or []
+                    )
+                )
+
+        if dateRange:
+            # the server compares whole minutes
+            start = int(dateRange[0] // 60 * 60 * 1000)
+            checks.append(lambda note: (note.created or 0) >= start)
+            if dateRange[1] is not None:
+                end = int(dateRange[1] // 60 * 60 * 1000)
+                checks.append(lambda note: (note.created or 0) < end)
+
+        if remindersOnly:
+            checks.append(
+                lambda note: note.attributes and note.attributes.reminderOrder
+            )
+        if ignoreCompleted:
+            checks.append(
+                lambda note: not (note.attributes and note.attributes.reminderDoneTime)
+            )
+
+        notes = [
+            note
+            for note in storage.getNotes() or []
+            if all(check(note) for check in checks)
+        ]
+
+        if ranked is not None:
+            notes.sort(key=lambda note: rank[note.guid])
+        else:
+            field = (
+                "created" if createOrder else SORT_FIELDS[self.geeknote.noteSortOrder]
+            )
+            empty = "" if field == "title" else 0
+            notes.sort(key=lambda note: getattr(note, field) or empty, reverse=True)
+
+        return NotesMetadataList(startIndex=0, totalNotes=len(notes), notes=notes[:count])
@@ -0,0 +1,130 @@
+"""
+Retries of idempotent store calls after transient network failures
+"""
+
+import collections
+import http.client
+import random
+import threading
+import time
+
+from thrift.transport.TTransport import TTransportException
+
+from . import config
+from .log import logging
+from .transport import HttpError
+from .stats import stats
+
+
+# read-only calls, safe to send again when the first attempt got lost
+IDEMPOTENT_CALLS = frozenset(
+    [
+        "findNotesMetadata",
+        "getNote",
+        "getNoteContent",
+        "getNoteSearchText",
+        "listTags",
+        "listNotebooks",
+        "listLinkedNotebooks",
+        "getTag",
+        "getNotebook",
+        "getResourceByHash",
+        "getSyncState",
+        "getFilteredSyncChunk",
+        "checkVersion",
+        "getNoteStoreUrl",
+        "getUser",
+    ]
+)
+
+
+def isTransient(error):
+    """
+    Network errors which may go away on their own:
+    socket resets, TLS errors, timeouts and HTTP 5xx answers
+    """
+    if isinstance(error, HttpError):
+        return error.status >= 500
+    return isinstance(error, (OSError, http.client.HTTPException, TTransportException))
+
+
+class RetryPolicy(object):
+    """
+    Bounded exponential backoff with full jitter.
+    A call is given up after `attempts` tries or when the next try would
+    end past `deadline` seconds from the first one.
+    """
+
+    def __init__(self, attempts, baseDelay, maxDelay, deadline):
+        self.attempts = attempts
+        self.baseDelay = baseDelay
+        self.maxDelay = maxDelay
+        self.deadline = deadline
+        self.counters = collections.Counter()
+        self.lock = threading.Lock()
+
+    def delay(self, attempt):
+        return random.uniform(0, min(self.maxDelay, self.baseDelay * 2 ** attempt))
+
+    def count(self, *keys):
+        with self.lock:
+            for key in keys:
+                self.counters[key] += 1
+
+    def call(self, name, func, *args, **kwargs):
+        start = time.monotonic()
+        attempt = 0
+        while True:
+            try:
+                result = func(*args, **kwargs)
+            except Exception as e:
+                if not isTransient(e):
+                    raise
+
+                attempt += 1
+                delay = self.delay(attempt)
+                if (
+                    attempt >= self.attempts
+                    or time.monotonic() - start + delay > self.deadline
+                ):
+                    self.count("exhausted", "exhausted:" + name)
+                    raise
+
+                self.count("retries", "retries:" + name)
+                stats.count("retries", name)
+                logging.warning(
+                    "%s failed (%s), retry %d in %.1f seconds", name, e, attempt, delay
+                )
+                time.sleep(delay)
+            else:
+                if attempt:
+                    self.count("recovered", "recovered:" + name)
+                return result
+
+
+policy = RetryPolicy(
+    config.RETRY_ATTEMPTS,
+    config.RETRY_BASE_DELAY,
+    config.RETRY_MAX_DELAY,
+    config.RETRY_DEADLINE,
+)
+
+
+class RetryingClient(object):
+    """
+    Wraps a thrift store client, idempotent calls are retried by the policy
+    """
+
+    def __init__(self, client, retryPolicy=None):
+        self._client = client
+        self._policy = retryPolicy or policy
+
+    def __getattr__(self, name):
+        attr = getattr(self._client, name)
+        if name in IDEMPOTENT_CALLS:
+
+            def retried(*args, **kwargs):
+                return self._policy.call(name, attr, *args, **kwargs)
+
+            return retried
+        return attr
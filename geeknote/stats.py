@@ -0,0 +1,166 @@
+"""
+Per-RPC statistics of the store calls made by this process
+"""
+
+import json
+import struct
+import threading
+import time
+
+from .log import logging
+
+
+# upper bounds of the latency histogram buckets, in milliseconds
+LATENCY_BUCKETS = (10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+
+def messageName(data):
+    """
+    Name of the call in a serialized thrift binary protocol message
+    returns None if data doesn't start with a message header
+    """
+    try:
+        (size,) = struct.unpack("!i", data[:4])
+        if size < 0:
+            # strict header: version and type, then the name
+            (size,) = struct.unpack("!i", data[4:8])
+            return data[8 : 8 + size].decode("utf-8")
+        return data[4 : 4 + size].decode("utf-8")
+    except (struct.error, UnicodeDecodeError):
+        return None
+
+
+class RpcStats(object):
+    """
+    Call count, latency histogram, bytes sent and received, retries and
+    rate limit hits of every RPC, collected by the store transport.
+    Latencies don't include the time spent waiting for the rate limiter.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.calls = {}
+            self.started = time.time()
+
+    def _entry(self, name):
+        entry = self.calls.get(name)
+        if entry is None:
+            entry = self.calls[name] = {
+                "calls": 0,
+                "errors": 0,
+                "retries": 0,
+                "rateLimitHits": 0,
+                "seconds": 0.0,
+                "maxSeconds": 0.0,
+                "throttledSeconds": 0.0,
+                "bytesSent": 0,
+                "bytesReceived": 0,
+                "histogram": [0] * (len(LATENCY_BUCKETS) + 1),
+            }
+        return entry
+
+    def begin(self, name):
+        """ Remember the call this thread is about to make """
+        self.local.name = name or "unknown"
+
+    def record(self, seconds, sent, received, throttled=0, error=False):
+        """ Add a finished call of this thread """
+        milliseconds = seconds * 1000
+        bucket = len(LATENCY_BUCKETS)
+        for index, bound in enumerate(LATENCY_BUCKETS):
+            if milliseconds <= bound:
+                bucket = index
+                break
+
+        with self.lock:
+            entry = self._entry(getattr(self.local, "name", "unknown"))
+            entry["calls"] += 1
+            entry["errors"] += 1 if error else 0
+            entry["seconds"] += seconds
+            entry["maxSeconds"] = max(entry["maxSeconds"], seconds)
+            entry["throttledSeconds"] += throttled
+            entry["bytesSent"] += sent
+            entry["bytesReceived"] += received
+            entry["histogram"][bucket] += 1
+
+    def count(self, key, name=None):
+        """
+        Count a retry or a rate limit hit of `name`,
+        by default of the last call of this thread
+        """
+        with self.lock:
+            entry = self._entry(name or getattr(self.local, "name", "unknown"))
+            entry[key] += 1
+
+    def summary(self):
+        """
+        returns a dict of RPC name: statistics, the histogram as
+        a dict of bucket label: calls
+        """
+        labels = ["<=%dms" % bound for bound in LATENCY_BUCKETS]
+        labels.append(">%dms" % LATENCY_BUCKETS[-1])
+        with self.lock:
+            result = {}
+            for name, entry in self.calls.items():
+                entry = dict(entry)
+                entry["histogram"] = dict(zip(labels, entry["histogram"]))
+                result[name] = entry
+            return result
+
+    def report(self):
+        """ returns the statistics as lines of a table, slowest calls first """
+        summary = self.summary()
+        lines = [
+            "%-24s %6s %6s %7s %6s %9s %9s %9s %9s"
+            % (
+                "RPC",
+                "calls",
+                "errors",
+                "retries",
+                "limits",
+                "mean ms",
+                "max ms",
+                "sent KB",
+                "recv KB",
+            )
+        ]
+        for name, entry in sorted(
+            summary.items(), key=lambda item: item[1]["seconds"], reverse=True
+        ):
+            lines.append(
+                "%-24s %6d %6d %7d %6d %9.1f %9.1f %9.1f %9.1f"
+                % (
+                    name,
+                    entry["calls"],
+                    entry["errors"],
+                    entry["retries"],
+                    entry["rateLimitHits"],
+                    entry["seconds"] * 1000 / max(entry["calls"], 1),
+                    entry["maxSeconds"] * 1000,
+                    entry["bytesSent"] / 1024.0,
+                    entry["bytesReceived"] / 1024.0,
+                )
+            )
+        return lines
+
+    def dump(self, path, command):
+        """ Write the statistics of `command` to a JSON file """
+        data = {
+            "command": command,
+            "started": self.started,
+            "finished": time.time(),
+            "calls": self.summary(),
+        }
+        try:
+            with open(path, "w") as f:
+                json.dump(data, f, indent=2, sort_keys=True)
+        except (IOError, OSError) as e:
+            logging.error("Cannot write RPC statistics to %s: %s", path, e)
+
+
+stats = RpcStats()
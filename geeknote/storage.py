@@ -109,6 +109,23 @@ class Search(Base):
         return "<Search('{0}')>".format(self.timestamp)
 
 
+class Cache(Base):
+    __tablename__ = "cache"
+
+    id = sqlalchemy.Column(sqlalchemy.Integer, primary_key=True)
+    key = sqlalchemy.Column(sqlalchemy.String(255))
+    value = sqlalchemy.Column(sqlalchemy.PickleType())
+    timestamp = sqlalchemy.Column(sqlalchemy.DateTime(), nullable=False)
+
+    def __init__(self, key, value):
+        self.key = key
+        self.value = value
+        self.timestamp = datetime.datetime.now()
+
+    def __repr__(self):
+        return "<Cache('{0}','{1}')>".format(self.key, self.timestamp)
+
+
 class Storage(object):
     """
     Class for using database
@@ -149,6 +166,7 @@ class Storage(object):
 
         for item in self.session.query(Userprop).all():
             self.session.delete(item)
+        self.clearCache()
 
         self.setUserprop("oAuthToken", oAuthToken)
         self.setUserprop("info", info_obj)
@@ -163,6 +181,7 @@ class Storage(object):
         """
         for item in self.session.query(Userprop).all():
             self.session.delete(item)
+        self.clearCache()
         self.session.commit()
         return True
 
@@ -240,6 +259,51 @@ class Storage(object):
             return True
         return False
 
+    @logging
+    def setCache(self, key, value):
+        """
+        Remember a session cache value
+        Cached values are dropped when the user changes
+        returns True if all done
+        """
+        instance = self.session.query(Cache).filter_by(key=key).first()
+        if instance:
+            instance.value = value
+            instance.timestamp = datetime.datetime.now()
+        else:
+            instance = Cache(key, value)
+            self.session.add(instance)
+
+        self.session.commit()
+        return True
+
+    @logging
+    def getCache(self, key, ttl=None):
+        """
+        Get a session cache value by key
+        returns the value if it exists and is not older than ttl seconds
+        returns None if the value doesn't exist or has expired
+        """
+        instance = self.session.query(Cache).filter_by(key=key).first()
+        if instance is None:
+            return None
+        if ttl is not None:
+            age = datetime.datetime.now() - instance.timestamp
+            if age.total_seconds() > ttl:
+                return None
+        return instance.value
+
+    @logging
+    def clearCache(self):
+        """
+        Remove all session cache values
+        returns True if all done
+        """
+        for item in self.session.query(Cache).all():
+            self.session.delete(item)
+        self.session.commit()
+        return True
+
     @logging
     def setSettings(self, settings):
         """
@@ -411,6 +475,166 @@ class Storage(object):
         else:
             return None
 
+    @logging
+    def getNotes(self):
+        """
+        Get all remembered notes
+        returns list of notes
+        returns [] if there are not any notes yet
+        """
+        return [pickle.loads(item.obj) for item in self.session.query(Note).all()]
+
+    @logging
+    def saveSyncChunk(
+        self,
+        notes=(),
+        notebooks=None,
+        tags=None,
+        expungedNotes=(),
+        expungedNotebooks=(),
+        expungedTags=(),
+    ):
+        """
+        Apply a chunk of changed metadata in one transaction
+        notes is a list of notes, notebooks and tags are dicts of guid: name,
+        the expunged* lists hold GUIDs of removed items
+        returns True if all done
+        """
+        guids = [note.guid for note in notes] + list(expungedNotes)
+        if guids:
+            self.session.query(Note).filter(Note.guid.in_(guids)).delete(
+                synchronize_session=False
+            )
+        for note in notes:
+            self.session.add(Note(note.guid, pickle.dumps(note)))
+
+        for model, items, expunged in (
+            (Notebook, notebooks or {}, expungedNotebooks),
+            (Tag, tags or {}, expungedTags),
+        ):
+            guids = list(items.keys()) + list(expunged)
+            if guids:
+                self.session.query(model).filter(model.guid.in_(guids)).delete(
+                    synchronize_session=False
+                )
+            for guid, name in items.items():
+                self.session.add(model(guid, name))
+
+        self.session.commit()
+        return True
+
+    @logging
+    def clearMetadata(self):
+        """
+        Remove all remembered notes, notebooks and tags
+        returns True if all done
+        """
+        for model in (Note, Notebook, Tag):
+            self.session.query(model).delete()
+        self.session.commit()
+        return True
+
+    def _createIndex(self):
+        if self.session.info.get("noteIndex"):
+            return
+        self.session.execute(
+            sqlalchemy.text(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS note_index USING fts5("
+                "guid UNINDEXED, usn UNINDEXED, title, content, tags, notebook, "
+                "tokenize='unicode61 remove_diacritics 2')"
+            )
+        )
+        self.session.info["noteIndex"] = True
+
+    @logging
+    def getIndexedNotes(self):
+        """
+        Get the notes of the full-text index
+        returns dict of guid: (usn, tags, notebook)
+        """
+        self._createIndex()
+        rows = self.session.execute(
+            sqlalchemy.text("SELECT guid, usn, tags, notebook FROM note_index")
+        )
+        return dict((row[0], tuple(row[1:])) for row in rows)
+
+    @logging
+    def indexNotes(self, notes):
+        """
+        Add notes to the full-text index, replacing their previous entries
+        notes is a list of (guid, usn, title, content, tags, notebook) tuples
+        returns True if all done
+        """
+        self._createIndex()
+        for note in notes:
+            self.session.execute(
+                sqlalchemy.text("DELETE FROM note_index WHERE guid = :guid"),
+                {"guid": note[0]},
+            )
+            self.session.execute(
+                sqlalchemy.text(
+                    "INSERT INTO note_index "
+                    "(guid, usn, title, content, tags, notebook) "
+                    "VALUES (:guid, :usn, :title, :content, :tags, :notebook)"
+                ),
+                dict(zip(("guid", "usn", "title", "content", "tags", "notebook"), note)),
+            )
+        self.session.commit()
+        return True
+
+    @logging
+    def renameIndexedNotes(self, notes):
+        """
+        Change the tag and notebook names of indexed notes
+        notes is a list of (guid, tags, notebook) tuples
+        returns True if all done
+        """
+        self._createIndex()
+        for guid, tags, notebook in notes:
+            self.session.execute(
+                sqlalchemy.text(
+                    "UPDATE note_index SET tags = :tags, notebook = :notebook "
+                    "WHERE guid = :guid"
+                ),
+                {"guid": guid, "tags": tags, "notebook": notebook},
+            )
+        self.session.commit()
+        return True
+
+    @logging
+    def removeIndexedNotes(self, guids):
+        """
+        Remove notes from the full-text index
+        returns True if all done
+        """
+        self._createIndex()
+        for guid in guids:
+            self.session.execute(
+                sqlalchemy.text("DELETE FROM note_index WHERE guid = :guid"),
+                {"guid": guid},
+            )
+        self.session.commit()
+        return True
+
+    @logging
+    def searchIndex(self, query, limit):
+        """
+        Search the full-text index with an FTS5 query
+        Title matches rank highest, then tags, notebook and content
+        returns list of (guid, snippet) tuples, best matches first
+        """
+        self._createIndex()
+        rows = self.session.execute(
+            sqlalchemy.text(
+                "SELECT guid, snippet(note_index, 3, '[', ']', '...', 12) "
+                "FROM note_index WHERE note_index MATCH :query "
+                "ORDER BY bm25(note_index, 0, 0, 10.0, 1.0, 5.0, 2.0) "
+                "LIMIT :limit"
+            ),
+            {"query": query, "limit": limit},
+        )
+        return [tuple(row) for row in rows]
+
     @logging
     def setSearch(self, search_obj):
         """
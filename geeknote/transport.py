@@ -0,0 +1,377 @@
+"""
+Keep-alive HTTP(S) transport shared by every thrift store client
+"""
+
+import base64
+import collections
+import http.client
+import json
+import os
+import sys
+import threading
+import time
+import urllib.parse
+import urllib.request
+from io import BytesIO
+
+import thrift.protocol.TBinaryProtocol as TBinaryProtocol
+from thrift.transport import TTransport
+
+from . import config
+from .log import logging
+from .ratelimit import governor
+from .stats import stats, messageName
+
+
+# errors raised when the server has silently dropped an idle keep-alive connection
+STALE_CONNECTION_ERRORS = (
+    http.client.RemoteDisconnected,
+    http.client.CannotSendRequest,
+    BrokenPipeError,
+    ConnectionResetError,
+)
+
+
+class HttpError(TTransport.TTransportException):
+    """ The store answered with an HTTP error status """
+
+    def __init__(self, status, reason):
+        TTransport.TTransportException.__init__(
+            self,
+            TTransport.TTransportException.UNKNOWN,
+            "HTTP %s %s" % (status, reason),
+        )
+        self.status = status
+
+
+class ConnectionPool(object):
+    """
+    Pool of persistent HTTP(S) connections, keyed by (scheme, host, port).
+    Reusing a connection skips the TCP handshake and TLS negotiation.
+    """
+
+    def __init__(self, maxSize, idleTimeout, perHostLimit):
+        self.maxSize = maxSize
+        self.idleTimeout = idleTimeout
+        self.perHostLimit = perHostLimit
+        self.idle = {}  # key -> [(connection, last used timestamp)]
+        self.busy = {}  # key -> number of connections handed out
+        self.lock = threading.Condition()
+
+    def acquire(self, key, connect):
+        """
+        Get a connection for the key, creating one with `connect` if there
+        is no idle connection left. Blocks while the host is at its limit.
+        returns (connection, True if the connection has been used before)
+        """
+        with self.lock:
+            while True:
+                self._expire()
+                idle = self.idle.get(key)
+                if idle:
+                    connection = idle.pop()[0]
+                    self.busy[key] = self.busy.get(key, 0) + 1
+                    return connection, True
+                if self.busy.get(key, 0) < self.perHostLimit:
+                    self.busy[key] = self.busy.get(key, 0) + 1
+                    break
+                self.lock.wait()
+
+        try:
+            return connect(), False
+        except:
+            self.release(key, None, False)
+            raise
+
+    def release(self, key, connection, reuse=True):
+        """
+        Give a connection back to the pool.
+        Connections which can't be reused are closed.
+        """
+        with self.lock:
+            self.busy[key] -= 1
+            if connection is not None:
+                if reuse and self.maxSize > 0:
+                    self.idle.setdefault(key, []).append((connection, time.time()))
+                    self._trim()
+                else:
+                    connection.close()
+            self.lock.notify_all()
+
+    def clear(self):
+        """ Close all idle connections """
+        with self.lock:
+            for idle in self.idle.values():
+                for connection, _ in idle:
+                    connection.close()
+            self.idle = {}
+
+    def _expire(self):
+        deadline = time.time() - self.idleTimeout
+        for key, idle in self.idle.items():
+            for item in [item for item in idle if item[1] < deadline]:
+                idle.remove(item)
+                item[0].close()
+
+    def _trim(self):
+        idle = [(item[1], key, item) for key, items in self.idle.items() for item in items]
+        if len(idle) <= self.maxSize:
+            return
+        idle.sort(key=lambda value: value[0])
+        for _, key, item in idle[: len(idle) - self.maxSize]:
+            self.idle[key].remove(item)
+            item[0].close()
+
+
+pool = ConnectionPool(
+    config.CONNECTION_POOL_SIZE,
+    config.CONNECTION_POOL_IDLE_TIMEOUT,
+    config.CONNECTION_POOL_PER_HOST,
+)
+
+
+class Recorder(object):
+    """
+    Writes every request/response exchange of the session to a file,
+    one JSON object per line with the exact bytes base64 encoded
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.file = None
+        self.lock = threading.Lock()
+
+    def record(self, uri, request, status, reason, response, seconds):
+        exchange = {
+            "uri": uri,
+            "request": base64.b64encode(request).decode("ascii"),
+            "status": status,
+            "reason": reason,
+            "response": base64.b64encode(response).decode("ascii"),
+            "seconds": round(seconds, 6),
+        }
+        with self.lock:
+            if self.file is None:
+                self.file = open(self.path, "w")
+            self.file.write(json.dumps(exchange, sort_keys=True) + "\n")
+            self.file.flush()
+
+
+class Replayer(object):
+    """
+    Answers requests with the responses of a recorded session, byte for byte.
+    Requests are matched by store url and content, identical requests get
+    their recorded responses in order. latency is a number of seconds to
+    wait before every answer, or "recorded" to wait as long as the
+    recorded exchange took.
+    """
+
+    def __init__(self, path, latency=None):
+        self.exchanges = collections.defaultdict(collections.deque)
+        self.latency = latency
+        self.lock = threading.Lock()
+        with open(path) as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                exchange = json.loads(line)
+                key = (exchange["uri"], base64.b64decode(exchange["request"]))
+                self.exchanges[key].append(
+                    (
+                        exchange["status"],
+                        exchange["reason"],
+                        base64.b64decode(exchange["response"]),
+                        exchange["seconds"],
+                    )
+                )
+
+    def replay(self, uri, request):
+        """
+        returns (status, reason, response) recorded for the request
+        """
+        with self.lock:
+            recorded = self.exchanges.get((uri, request))
+            if not recorded:
+                raise TTransport.TTransportException(
+                    TTransport.TTransportException.UNKNOWN,
+                    "No recorded response for a call to %s" % uri,
+                )
+            status, reason, response, seconds = recorded.popleft()
+
+        if self.latency == "recorded":
+            time.sleep(seconds)
+        elif self.latency:
+            time.sleep(float(self.latency))
+        return status, reason, response
+
+
+recorder = Recorder(config.RECORD_FILE) if config.RECORD_FILE else None
+replayer = (
+    Replayer(config.REPLAY_FILE, config.REPLAY_LATENCY) if config.REPLAY_FILE else None
+)
+
+
+class PooledHttpClient(TTransport.TTransportBase):
+    """
+    Drop-in replacement for thrift's THttpClient.
+    THttpClient opens a new connection for every request, this transport
+    borrows a keep-alive connection from the pool instead and reads the whole
+    response, so the connection can be handed back right away.
+    """
+
+    def __init__(self, uri, connectionPool=None):
+        parsed = urllib.parse.urlparse(uri)
+        self.scheme = parsed.scheme
+        if self.scheme not in ("http", "https"):
+            raise ValueError("Unsupported store url: %s" % uri)
+
+        self.host = parsed.hostname
+        if self.scheme == "https":
+            self.port = parsed.port or http.client.HTTPS_PORT
+        else:
+            self.port = parsed.port or http.client.HTTP_PORT
+        self.path = parsed.path
+        if parsed.query:
+            self.path += "?%s" % parsed.query
+
+        self.proxy = None
+        self.proxyAuth = None
+        proxy = urllib.request.getproxies().get(self.scheme)
+        if proxy and not urllib.request.proxy_bypass(self.host):
+            self.proxy = urllib.parse.urlparse(proxy)
+            if self.proxy.username:
+                credentials = "%s:%s" % (
+                    urllib.parse.unquote(self.proxy.username),
+                    urllib.parse.unquote(self.proxy.password or ""),
+                )
+                self.proxyAuth = "Basic " + base64.b64encode(
+                    credentials.encode()
+                ).decode("ascii")
+
+        self.uri = uri
+        self.pool = connectionPool or pool
+        self.recorder = recorder
+        self.replayer = replayer
+        self.key = (self.scheme, self.host, self.port)
+        self.timeout = config.CONNECTION_TIMEOUT
+        self.headers = None
+        self.code = None
+        self.__wbuf = BytesIO()
+        self.__rbuf = BytesIO()
+
+    def isOpen(self):
+        return True
+
+    def open(self):
+        pass
+
+    def close(self):
+        pass
+
+    def setTimeout(self, ms):
+        self.timeout = None if ms is None else ms / 1000.0
+
+    def read(self, sz):
+        return self.__rbuf.read(sz)
+
+    def write(self, buf):
+        self.__wbuf.write(buf)
+
+    def flush(self):
+        data = self.__wbuf.getvalue()
+        self.__wbuf = BytesIO()
+        stats.begin(messageName(data))
+        start = time.monotonic()
+        # a replayed session doesn't reach the server
+        if not self.replayer:
+            governor.acquire()
+        throttled = time.monotonic() - start
+        try:
+            body = self._request(data)
+        except:
+            stats.record(
+                time.monotonic() - start - throttled, len(data), 0, throttled, True
+            )
+            raise
+        stats.record(time.monotonic() - start - throttled, len(data), len(body), throttled)
+        self.__rbuf = BytesIO(body)
+
+    def _connect(self):
+        host, port = self.host, self.port
+        if self.proxy:
+            host, port = self.proxy.hostname, self.proxy.port
+
+        if self.scheme == "https":
+            connection = http.client.HTTPSConnection(host, port, timeout=self.timeout)
+        else:
+            connection = http.client.HTTPConnection(host, port, timeout=self.timeout)
+
+        if self.proxy:
+            headers = {}
+            if self.proxyAuth:
+                headers["Proxy-Authorization"] = self.proxyAuth
+            connection.set_tunnel(self.host, self.port, headers)
+
+        logging.debug("New connection to %s://%s:%s", *self.key)
+        return connection
+
+    def _request(self, data):
+        if self.replayer:
+            status, reason, body = self.replayer.replay(self.uri, data)
+        else:
+            start = time.monotonic()
+            status, reason, body = self._exchange(data)
+            if self.recorder:
+                self.recorder.record(
+                    self.uri, data, status, reason, body, time.monotonic() - start
+                )
+
+        self.code = status
+        if status != 200:
+            raise HttpError(status, reason)
+        return body
+
+    def _exchange(self, data):
+        while True:
+            connection, reused = self.pool.acquire(self.key, self._connect)
+            try:
+                connection.timeout = self.timeout
+                connection.putrequest("POST", self.path, skip_accept_encoding=True)
+                connection.putheader("Content-Type", "application/x-thrift")
+                connection.putheader("Content-Length", str(len(data)))
+                connection.putheader("User-Agent", self._userAgent())
+                # keep the session cookie the server has sent us
+                if self.headers and "Set-Cookie" in self.headers:
+                    connection.putheader("Cookie", self.headers["Set-Cookie"])
+                connection.endheaders()
+                connection.send(data)
+
+                response = connection.getresponse()
+                body = response.read()
+            except STALE_CONNECTION_ERRORS:
+                self.pool.release(self.key, connection, False)
+                if reused:
+                    # the server has closed the idle connection, try a new one
+                    continue
+                raise
+            except:
+                self.pool.release(self.key, connection, False)
+                raise
+
+            self.pool.release(self.key, connection, not response.will_close)
+
+            self.headers = response.msg
+            return response.status, response.reason, body
+
+    @staticmethod
+    def _userAgent():
+        script = os.path.basename(sys.argv[0]) if sys.argv else ""
+        userAgent = "Python/THttpClient"
+        if script:
+            userAgent += " (%s)" % urllib.parse.quote(script)
+        return userAgent
+
+
+def getProtocol(uri):
+    """ Thrift protocol for a store, talking through the connection pool """
+    return TBinaryProtocol.TBinaryProtocol(PooledHttpClient(uri))
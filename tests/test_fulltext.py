@@ -0,0 +1,126 @@
+import unittest
+
+from evernote2.edam.notestore.ttypes import NoteMetadata
+from sqlalchemy.engine import create_engine
+from sqlalchemy.orm.session import sessionmaker
+
+from geeknote import storage
+from geeknote.fulltext import SearchIndex, toQuery
+from geeknote.replica import Replica
+
+
+def memoryStorage():
+    engine = create_engine("sqlite:///:memory:", echo=False)
+    storage.Base.metadata.create_all(engine)
+    stor = storage.Storage.__new__(storage.Storage)
+    stor.session = sessionmaker(bind=engine)()
+    return stor
+
+
+class FakeGeeknote(object):
+    noteSortOrder = "UPDATED"
+
+    def __init__(self, stor):
+        self.storage = stor
+        self.texts = {}
+        self.downloaded = []
+
+    def getStorage(self):
+        return self.storage
+
+    def map(self, func, *iterables):
+        return map(func, *iterables)
+
+    def getNoteSearchText(self, guid):
+        self.downloaded.append(guid)
+        return self.texts[guid]
+
+
+class testSearchIndex(unittest.TestCase):
+    def setUp(self):
+        self.geeknote = FakeGeeknote(memoryStorage())
+        self.storage = self.geeknote.storage
+        self.storage.saveSyncChunk(
+            [
+                NoteMetadata(
+                    guid="a", title="Holiday plans", updateSequenceNum=1,
+                    notebookGuid="n1", tagGuids=["t1"],
+                ),
+                NoteMetadata(
+                    guid="b", title="Budget", updateSequenceNum=2,
+                    notebookGuid="n2",
+                ),
+            ],
+            {"n1": "Personal", "n2": "Work"},
+            {"t1": "travel"},
+        )
+        self.geeknote.texts = {
+            "a": "Flights to Lisbon in May, hotel near the river",
+            "b": "Quarterly budget for the holiday season campaign",
+        }
+        self.index = SearchIndex(self.geeknote)
+        self.index.update()
+
+    def guids(self, search, exact=False):
+        return [guid for guid, snippet in self.index.search(search, exact)]
+
+    def test_search_content(self):
+        self.assertEqual(self.guids("lisbon"), ["a"])
+        self.assertEqual(self.guids("campaign budget"), ["b"])
+        self.assertEqual(self.guids("nothing"), [])
+
+    def test_title_ranks_higher(self):
+        self.assertEqual(self.guids("holiday"), ["a", "b"])
+
+    def test_tags_and_notebooks(self):
+        self.assertEqual(self.guids("travel"), ["a"])
+        self.assertEqual(self.guids("work"), ["b"])
+
+    def test_prefix_and_phrase(self):
+        self.assertEqual(self.guids("lis*"), ["a"])
+        self.assertEqual(self.guids("holiday season", exact=True), ["b"])
+
+    def test_snippet(self):
+        snippet = dict(self.index.search("lisbon"))["a"]
+        self.assertIn("[Lisbon]", snippet)
+
+    def test_update_is_incremental(self):
+        self.geeknote.downloaded = []
+        self.index.update()
+        self.assertEqual(self.geeknote.downloaded, [])
+
+        self.storage.saveSyncChunk(
+            [
+                NoteMetadata(
+                    guid="b", title="Budget", updateSequenceNum=3,
+                    notebookGuid="n2",
+                )
+            ],
+            tags={"t1": "trips"},
+            expungedNotes=["a"],
+        )
+        self.geeknote.texts["b"] = "Yearly numbers"
+        result = self.index.update()
+        self.assertEqual(self.geeknote.downloaded, ["b"])
+        self.assertEqual(result["removed"], 1)
+        self.assertEqual(self.guids("yearly"), ["b"])
+        self.assertEqual(self.guids("lisbon"), [])
+
+    def test_renamed_tag(self):
+        self.storage.saveSyncChunk(tags={"t1": "trips"})
+        result = self.index.update()
+        self.assertEqual(result, {"indexed": 0, "renamed": 1, "removed": 0})
+        self.assertEqual(self.guids("trips"), ["a"])
+
+    def test_filter_ranked_notes(self):
+        ranked = self.guids("holiday")
+        result = Replica(self.geeknote).findNotes(notebook="work", ranked=ranked)
+        self.assertEqual([note.guid for note in result.notes], ["b"])
+
+
+class testToQuery(unittest.TestCase):
+    def test_words(self):
+        self.assertEqual(toQuery("foo bar*"), '"foo" "bar"*')
+
+    def test_phrase(self):
+        self.assertEqual(toQuery('say "hi"', exact=True), '"say ""hi"""')
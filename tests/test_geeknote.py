@@ -1,4 +1,5 @@
 import sys
+import threading
 import time
 import unittest
 from io import StringIO
@@ -6,6 +7,7 @@ from geeknote.geeknote import *
 from geeknote import tools
 from geeknote.editor import Editor
 from geeknote.storage import Storage
+from evernote2.edam.notestore.ttypes import NoteMetadata, NotesMetadataList
 
 
 class GeekNoteOver(GeekNote):
@@ -131,3 +133,98 @@ class testNotes(unittest.TestCase):
         with self.assertRaises(tools.ExitException):
             self.notes._createSearchRequest(search="test text",
                                             date="12-31-1999")
+
+
+class testGeekNoteConcurrency(unittest.TestCase):
+
+    def setUp(self):
+        self.geeknote = GeekNote(skipInitConnection=True)
+        GeekNote.noteStoreUrl = "http://127.0.0.1:9/edam/note"
+
+    def tearDown(self):
+        GeekNote.noteStoreUrl = None
+        GeekNote.local = threading.local()
+
+    def test_store_per_thread(self):
+        mainStore = self.geeknote.getNoteStore()
+        self.assertIs(self.geeknote.getNoteStore(), mainStore)
+        workerStore = self.geeknote.submit(self.geeknote.getNoteStore).result()
+        self.assertIsNot(workerStore, mainStore)
+
+    def test_map_keeps_order(self):
+        def slow_square(value):
+            time.sleep(0.01 * (5 - value))
+            return value * value
+
+        result = list(self.geeknote.map(slow_square, range(5)))
+        self.assertEqual(result, [0, 1, 4, 9, 16])
+
+    def test_find_notes_pages(self):
+        class PagedNoteStore(object):
+            def __init__(self, total, serverMax):
+                self.total = total
+                self.serverMax = serverMax
+                self.calls = []
+
+            def findNotesMetadata(self, authToken, noteFilter, offset, maxNotes, meta):
+                self.calls.append((offset, maxNotes))
+                guids = range(offset, min(offset + maxNotes, offset + self.serverMax, self.total))
+                return NotesMetadataList(
+                    startIndex=offset,
+                    totalNotes=self.total,
+                    notes=[NoteMetadata(guid=str(guid)) for guid in guids],
+                )
+
+        noteStore = PagedNoteStore(600, 250)
+        self.geeknote.getNoteStore = lambda: noteStore
+        self.geeknote.sleepOnRateLimit = False
+
+        result = self.geeknote.findNotes("", EDAM_USER_NOTES_MAX)
+        self.assertEqual([note.guid for note in result.notes], [str(i) for i in range(600)])
+        self.assertEqual(sorted(noteStore.calls), [(0, 250), (250, 250), (500, 100)])
+
+        noteStore.calls = []
+        result = self.geeknote.findNotes("", 300)
+        self.assertEqual(len(result.notes), 300)
+        self.assertEqual(sorted(noteStore.calls), [(0, 250), (250, 50)])
+
+        # the server may return less than asked for
+        noteStore = PagedNoteStore(300, 100)
+        result = self.geeknote.findNotes("", EDAM_USER_NOTES_MAX)
+        self.assertEqual([note.guid for note in result.notes], [str(i) for i in range(300)])
+
+        # pages are fetched ahead of the consumer, but not all at once
+        noteStore = PagedNoteStore(5000, 250)
+        self.geeknote.concurrency = 2
+        notes = self.geeknote.iterNotes(self.geeknote.getNoteFilter(""))
+        self.assertEqual(notes.totalNotes, 5000)
+        self.assertEqual(len(notes), 5000)
+        self.assertEqual(noteStore.calls, [(0, 250)])
+        iterator = iter(notes)
+        for _ in range(251):
+            next(iterator)
+        self.assertLessEqual(len(noteStore.calls), 4)
+        self.assertEqual(len(list(iterator)), 5000 - 251)
+        self.assertEqual(len(noteStore.calls), 20)
+
+
+class testMetadataSpec(unittest.TestCase):
+
+    def setUp(self):
+        self.geeknote = GeekNote(skipInitConnection=True)
+
+    def test_all_fields_by_default(self):
+        meta = self.geeknote.getMetadataSpec()
+        self.assertTrue(meta.includeTitle)
+        self.assertTrue(meta.includeLargestResourceSize)
+        self.assertTrue(meta.includeUpdateSequenceNum)
+
+    def test_projection(self):
+        meta = self.geeknote.getMetadataSpec(["title", "updated"])
+        self.assertTrue(meta.includeTitle)
+        self.assertTrue(meta.includeUpdated)
+        self.assertIsNone(meta.includeAttributes)
+        self.assertIsNone(meta.includeTagGuids)
+
+    def test_unknown_field(self):
+        self.assertRaises(ValueError, self.geeknote.getMetadataSpec, ["body"])
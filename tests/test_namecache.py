@@ -0,0 +1,90 @@
+import unittest
+
+from evernote2.edam.type.ttypes import Notebook, Tag
+from sqlalchemy.engine import create_engine
+from sqlalchemy.orm.session import sessionmaker
+
+from geeknote import storage
+from geeknote.namecache import NameCache
+
+
+def memoryStorage():
+    engine = create_engine("sqlite:///:memory:", echo=False)
+    storage.Base.metadata.create_all(engine)
+    stor = storage.Storage.__new__(storage.Storage)
+    stor.session = sessionmaker(bind=engine)()
+    return stor
+
+
+class SyncState(object):
+    def __init__(self, updateCount):
+        self.updateCount = updateCount
+
+
+class FakeGeeknote(object):
+    def __init__(self, stor):
+        self.storage = stor
+        self.updateCount = 1
+        self.tags = [Tag(guid="t1", name="first"), Tag(guid="t2", name="second")]
+        self.notebooks = [Notebook(guid="n1", name="notes")]
+        self.calls = []
+
+    def getStorage(self):
+        return self.storage
+
+    def getSyncState(self):
+        self.calls.append("getSyncState")
+        return SyncState(self.updateCount)
+
+    def findTags(self):
+        self.calls.append("listTags")
+        return self.tags
+
+    def findNotebooks(self):
+        self.calls.append("listNotebooks")
+        return self.notebooks
+
+
+class testNameCache(unittest.TestCase):
+    def setUp(self):
+        self.geeknote = FakeGeeknote(memoryStorage())
+        self.cache = NameCache(self.geeknote)
+
+    def test_names_are_fetched_once(self):
+        self.assertEqual(self.cache.getName("tags", "t1"), "first")
+        self.assertEqual(self.cache.getName("tags", "t2"), "second")
+        self.assertEqual(self.cache.getName("notebooks", "n1"), "notes")
+        self.assertEqual(self.geeknote.calls.count("listTags"), 1)
+        self.assertEqual(self.geeknote.calls.count("listNotebooks"), 1)
+
+    def test_stored_names_reused_while_usn_unchanged(self):
+        self.cache.getName("tags", "t1")
+        self.geeknote.calls = []
+        cache = NameCache(self.geeknote)
+        self.assertEqual(cache.getName("tags", "t2"), "second")
+        self.assertEqual(self.geeknote.calls, ["getSyncState"])
+
+    def test_stored_names_refetched_after_usn_change(self):
+        self.cache.getName("tags", "t1")
+        self.geeknote.updateCount = 2
+        self.geeknote.tags = [Tag(guid="t1", name="renamed")]
+        cache = NameCache(self.geeknote)
+        self.assertEqual(cache.getName("tags", "t1"), "renamed")
+
+    def test_unknown_guid_refetches_once(self):
+        self.cache.getName("tags", "t1")
+        self.geeknote.tags = self.geeknote.tags + [Tag(guid="t3", name="third")]
+        self.assertEqual(self.cache.getName("tags", "t3"), "third")
+        self.assertIsNone(self.cache.getName("tags", "t4"))
+        self.assertEqual(self.geeknote.calls.count("listTags"), 2)
+
+    def test_get_guid(self):
+        self.assertEqual(self.cache.getGuid("notebooks", "notes"), "n1")
+        self.assertIsNone(self.cache.getGuid("notebooks", "missing"))
+
+    def test_invalidate(self):
+        self.cache.getName("notebooks", "n1")
+        self.geeknote.notebooks = [Notebook(guid="n1", name="renamed")]
+        self.cache.invalidate("notebooks")
+        self.assertEqual(self.cache.getName("notebooks", "n1"), "renamed")
+        self.assertEqual(self.geeknote.calls.count("listNotebooks"), 2)
@@ -161,6 +161,14 @@ Tags: tag1, tag2, tag3
         sys.stdout.seek(0)
         self.assertEqual(sys.stdout.read(), notes_list)
 
+    def test_print_list_of_generator_success(self):
+        notes_list = '''Found 2 items
+  1 : 2004-09-17 2004-09-17 testnote
+  2 : 2004-09-17 2004-09-17 testnote\n'''
+        printList((NoteStub() for _ in range(2)), total=2)
+        sys.stdout.seek(0)
+        self.assertEqual(sys.stdout.read(), notes_list)
+
     def test_print_list_with_title_success(self):
         notes_list = '''=================== test ==================
 Found 2 items
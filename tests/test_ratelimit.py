@@ -0,0 +1,52 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from evernote2.edam.error.ttypes import EDAMSystemException
+
+from geeknote.ratelimit import RateLimiter
+
+
+class testRateLimiter(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, "ratelimit.json")
+        self.limiter = RateLimiter(self.path, rate=50, burst=2, budget=100)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_burst_is_not_throttled(self):
+        start = time.monotonic()
+        self.limiter.acquire()
+        self.limiter.acquire()
+        self.assertLess(time.monotonic() - start, 0.02)
+
+    def test_empty_bucket_is_throttled(self):
+        start = time.monotonic()
+        for _ in range(4):
+            self.limiter.acquire()
+        # two calls over the burst at 50 calls/s
+        self.assertGreaterEqual(time.monotonic() - start, 0.035)
+
+    def test_backoff_is_shared(self):
+        other = RateLimiter(self.path, rate=50, burst=2, budget=100)
+        self.limiter.backoff(30)
+        self.assertGreater(other.remaining(), 28)
+        with self.assertRaises(EDAMSystemException) as context:
+            other.acquire()
+        self.assertEqual(context.exception.errorCode, 19)
+        self.assertEqual(other.calls, 0)
+
+    def test_report_usage(self):
+        other = RateLimiter(self.path, rate=50, burst=2, budget=100)
+        self.limiter.acquire()
+        other.acquire()
+        other.acquire()
+        usage = other.report("find")
+        self.assertEqual(usage["calls"], 2)
+        self.assertEqual(usage["hourCalls"], 3)
+        self.assertEqual(self.limiter.lastUsage()["command"], "find")
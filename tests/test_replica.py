@@ -0,0 +1,186 @@
+import unittest
+
+from evernote2.edam.notestore.ttypes import SyncChunk, SyncState
+import evernote2.edam.type.ttypes as Types
+from sqlalchemy.engine import create_engine
+from sqlalchemy.orm.session import sessionmaker
+
+from geeknote import storage
+from geeknote.namecache import NameCache
+from geeknote.replica import Replica
+
+
+def memoryStorage():
+    engine = create_engine("sqlite:///:memory:", echo=False)
+    storage.Base.metadata.create_all(engine)
+    stor = storage.Storage.__new__(storage.Storage)
+    stor.session = sessionmaker(bind=engine)()
+    return stor
+
+
+def note(guid, title, usn, notebook="n1", tags=None, created=0, **kwargs):
+    return Types.Note(
+        guid=guid,
+        title=title,
+        updateSequenceNum=usn,
+        notebookGuid=notebook,
+        tagGuids=tags,
+        created=created,
+        updated=created,
+        attributes=Types.NoteAttributes(**kwargs),
+    )
+
+
+class FakeServer(object):
+    """ Serves sync chunks of a list of changes, one change per USN """
+
+    def __init__(self, stor):
+        self.storage = stor
+        self.noteSortOrder = "UPDATED"
+        self.changes = []  # (usn, chunk attribute, value)
+        self.fullSyncBefore = 0
+        self.chunkCalls = 0
+        self.nameCache = NameCache(self)
+
+    def add(self, kind, value):
+        self.changes.append((len(self.changes) + 1, kind, value))
+
+    def getStorage(self):
+        return self.storage
+
+    def getNameCache(self):
+        return self.nameCache
+
+    def getSyncState(self):
+        return SyncState(
+            currentTime=1000,
+            fullSyncBefore=self.fullSyncBefore,
+            updateCount=len(self.changes),
+        )
+
+    def getFilteredSyncChunk(self, afterUSN, maxEntries, syncFilter):
+        self.chunkCalls += 1
+        chunk = SyncChunk(currentTime=1000, updateCount=len(self.changes))
+        changes = [change for change in self.changes if change[0] > afterUSN]
+        for usn, kind, value in changes[:maxEntries]:
+            items = getattr(chunk, kind) or []
+            items.append(value)
+            setattr(chunk, kind, items)
+            chunk.chunkHighUSN = usn
+        return chunk
+
+
+class testReplica(unittest.TestCase):
+    def setUp(self):
+        self.server = FakeServer(memoryStorage())
+        self.server.add("notebooks", Types.Notebook(guid="n1", name="Inbox"))
+        self.server.add("notebooks", Types.Notebook(guid="n2", name="Work"))
+        self.server.add("tags", Types.Tag(guid="t1", name="urgent"))
+        self.server.add("notes", note("a", "Shopping list", 4, created=3000))
+        self.server.add(
+            "notes", note("b", "Meeting notes", 5, "n2", ["t1"], created=1000)
+        )
+        self.server.add(
+            "notes", note("c", "Weekly report", 6, "n2", created=2000, reminderOrder=1)
+        )
+        self.replica = Replica(self.server)
+
+    def titles(self, result):
+        return [item.title for item in result.notes]
+
+    def test_full_sync(self):
+        result = self.replica.sync()
+        self.assertEqual(result["notes"], 3)
+        self.assertEqual(result["notebooks"], 2)
+        self.assertEqual(result["usn"], 6)
+        self.assertTrue(self.replica.isFresh())
+        self.assertEqual(
+            [notebook.name for notebook in self.replica.getNotebooks()],
+            ["Inbox", "Work"],
+        )
+        self.assertEqual(self.server.nameCache.getName("tags", "t1"), "urgent")
+
+    def test_incremental_sync(self):
+        self.replica.sync()
+        self.server.add("notes", note("a", "Groceries", 7))
+        self.server.add("expungedNotes", "b")
+        # trusted until REPLICA_MAX_AGE has passed
+        self.assertTrue(self.replica.isFresh())
+        self.replica.invalidate()
+        self.assertFalse(self.replica.isFresh())
+
+        calls = self.server.chunkCalls
+        result = self.replica.sync()
+        self.assertEqual(self.server.chunkCalls, calls + 1)
+        self.assertEqual(result["notes"], 1)
+        self.assertEqual(result["expunged"], 1)
+        self.assertEqual(
+            sorted(item.title for item in self.server.storage.getNotes()),
+            ["Groceries", "Weekly report"],
+        )
+
+    def test_sync_in_chunks(self):
+        from geeknote import config
+
+        chunkSize = config.REPLICA_CHUNK_SIZE
+        config.REPLICA_CHUNK_SIZE = 2
+        try:
+            self.replica.sync()
+        finally:
+            config.REPLICA_CHUNK_SIZE = chunkSize
+        self.assertEqual(self.server.chunkCalls, 3)
+        self.assertEqual(len(self.server.storage.getNotes()), 3)
+
+    def test_full_sync_before(self):
+        self.replica.sync()
+        self.server.fullSyncBefore = 2000
+        calls = self.server.chunkCalls
+        self.replica.sync()
+        self.assertGreater(self.server.chunkCalls, calls)
+        self.assertEqual(len(self.server.storage.getNotes()), 3)
+
+    def test_invalidate(self):
+        self.replica.sync()
+        self.replica.invalidate()
+        self.assertTrue(self.replica.isFresh())
+        self.server.add("tags", Types.Tag(guid="t2", name="later"))
+        self.replica.invalidate()
+        self.assertFalse(self.replica.isFresh())
+
+    def test_find_all(self):
+        self.replica.sync()
+        result = self.replica.findNotes("*")
+        self.assertEqual(result.totalNotes, 3)
+        self.assertEqual(
+            self.titles(result), ["Shopping list", "Weekly report", "Meeting notes"]
+        )
+        self.assertEqual(self.replica.findNotes(count=1).totalNotes, 3)
+        self.assertEqual(len(self.replica.findNotes(count=1).notes), 1)
+
+    def test_find_by_title(self):
+        self.replica.sync()
+        self.assertEqual(self.titles(self.replica.findNotes("meet")), ["Meeting notes"])
+        self.assertEqual(
+            self.titles(self.replica.findNotes("notes meeting", exact=True)), []
+        )
+        self.assertIsNone(self.replica.findNotes("notes meeting"))
+
+    def test_find_by_notebook_and_tag(self):
+        self.replica.sync()
+        self.assertEqual(
+            self.titles(self.replica.findNotes(notebook="work")),
+            ["Weekly report", "Meeting notes"],
+        )
+        self.assertEqual(
+            self.titles(self.replica.findNotes(notebook="Work", tags=["-urgent"])),
+            ["Weekly report"],
+        )
+        self.assertEqual(
+            self.titles(self.replica.findNotes(tags=["urgent"])), ["Meeting notes"]
+        )
+
+    def test_find_reminders(self):
+        self.replica.sync()
+        self.assertEqual(
+            self.titles(self.replica.findNotes(remindersOnly=True)), ["Weekly report"]
+        )
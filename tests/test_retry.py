@@ -0,0 +1,71 @@
+import unittest
+
+from geeknote.retry import RetryPolicy, RetryingClient, isTransient
+from geeknote.transport import HttpError
+
+
+class FlakyClient(object):
+    def __init__(self, failures, error=None):
+        self.failures = failures
+        self.error = error or ConnectionResetError("reset by peer")
+        self.calls = 0
+
+    def _call(self):
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise self.error
+        return "result"
+
+    def getNote(self, *args):
+        return self._call()
+
+    def createNote(self, *args):
+        return self._call()
+
+
+class testRetry(unittest.TestCase):
+
+    def setUp(self):
+        self.policy = RetryPolicy(attempts=3, baseDelay=0.001, maxDelay=0.01, deadline=5)
+
+    def test_transient_errors(self):
+        self.assertTrue(isTransient(ConnectionResetError()))
+        self.assertTrue(isTransient(HttpError(503, "Service Unavailable")))
+        self.assertFalse(isTransient(HttpError(404, "Not Found")))
+        self.assertFalse(isTransient(ValueError()))
+
+    def test_idempotent_call_retried(self):
+        client = FlakyClient(failures=2)
+        store = RetryingClient(client, self.policy)
+        self.assertEqual(store.getNote("token", "guid"), "result")
+        self.assertEqual(client.calls, 3)
+        self.assertEqual(self.policy.counters["retries:getNote"], 2)
+        self.assertEqual(self.policy.counters["recovered"], 1)
+
+    def test_other_call_not_retried(self):
+        client = FlakyClient(failures=1)
+        store = RetryingClient(client, self.policy)
+        with self.assertRaises(ConnectionResetError):
+            store.createNote("token", "note")
+        self.assertEqual(client.calls, 1)
+
+    def test_attempts_exhausted(self):
+        client = FlakyClient(failures=5)
+        store = RetryingClient(client, self.policy)
+        with self.assertRaises(ConnectionResetError):
+            store.getNote("token", "guid")
+        self.assertEqual(client.calls, 3)
+        self.assertEqual(self.policy.counters["exhausted"], 1)
+
+    def test_deadline_exhausted(self):
+        policy = RetryPolicy(attempts=10, baseDelay=1, maxDelay=1, deadline=0)
+        client = FlakyClient(failures=5)
+        with self.assertRaises(ConnectionResetError):
+            RetryingClient(client, policy).getNote("token", "guid")
+        self.assertEqual(client.calls, 1)
+
+    def test_permanent_error_not_retried(self):
+        client = FlakyClient(failures=1, error=ValueError("bad"))
+        with self.assertRaises(ValueError):
+            RetryingClient(client, self.policy).getNote("token", "guid")
+        self.assertEqual(client.calls, 1)
@@ -0,0 +1,80 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from thrift.protocol.TBinaryProtocol import TBinaryProtocol
+from thrift.Thrift import TMessageType
+from thrift.transport.TTransport import TMemoryBuffer
+
+from geeknote.stats import RpcStats, messageName
+
+
+class testMessageName(unittest.TestCase):
+
+    def message(self, strict):
+        buffer = TMemoryBuffer()
+        protocol = TBinaryProtocol(buffer, strictWrite=strict)
+        protocol.writeMessageBegin("getNoteContent", TMessageType.CALL, 7)
+        return buffer.getvalue()
+
+    def test_strict_header(self):
+        self.assertEqual(messageName(self.message(True)), "getNoteContent")
+
+    def test_old_header(self):
+        self.assertEqual(messageName(self.message(False)), "getNoteContent")
+
+    def test_garbage(self):
+        self.assertIsNone(messageName(b"\x01"))
+
+
+class testRpcStats(unittest.TestCase):
+
+    def setUp(self):
+        self.stats = RpcStats()
+
+    def test_record(self):
+        self.stats.begin("getNote")
+        self.stats.record(0.02, 100, 2000)
+        self.stats.record(0.3, 100, 1000, throttled=0.5)
+        self.stats.count("retries")
+        self.stats.begin("listTags")
+        self.stats.record(0.001, 50, 60, error=True)
+        self.stats.count("rateLimitHits")
+
+        summary = self.stats.summary()
+        entry = summary["getNote"]
+        self.assertEqual(entry["calls"], 2)
+        self.assertEqual(entry["retries"], 1)
+        self.assertEqual(entry["bytesReceived"], 3000)
+        self.assertAlmostEqual(entry["maxSeconds"], 0.3)
+        self.assertAlmostEqual(entry["throttledSeconds"], 0.5)
+        self.assertEqual(entry["histogram"]["<=25ms"], 1)
+        self.assertEqual(entry["histogram"]["<=500ms"], 1)
+        self.assertEqual(summary["listTags"]["errors"], 1)
+        self.assertEqual(summary["listTags"]["rateLimitHits"], 1)
+
+    def test_report_slowest_first(self):
+        self.stats.begin("fast")
+        self.stats.record(0.001, 1, 1)
+        self.stats.begin("slow")
+        self.stats.record(1.0, 1, 1)
+        lines = self.stats.report()
+        self.assertTrue(lines[0].startswith("RPC"))
+        self.assertTrue(lines[1].startswith("slow"))
+        self.assertTrue(lines[2].startswith("fast"))
+
+    def test_dump(self):
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, "stats.json")
+            self.stats.begin("getNote")
+            self.stats.record(0.01, 1, 2)
+            self.stats.dump(path, "show")
+            with open(path) as f:
+                data = json.load(f)
+            self.assertEqual(data["command"], "show")
+            self.assertEqual(data["calls"]["getNote"]["calls"], 1)
+        finally:
+            shutil.rmtree(directory)
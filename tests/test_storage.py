@@ -145,6 +145,27 @@ class storageTest(unittest.TestCase):
     def test_set_search_true(self):
         self.assertTrue(self.storage.setSearch('my query'))
 
+    def test_get_empty_cache(self):
+        self.assertIsNone(self.storage.getCache('noteStoreUrl'))
+
+    def test_set_cache_success(self):
+        self.assertTrue(self.storage.setCache('noteStoreUrl', 'https://url'))
+        self.assertEqual(self.storage.getCache('noteStoreUrl', 60), 'https://url')
+
+    def test_replace_cache_success(self):
+        self.storage.setCache('userIds', (1, 's1'))
+        self.storage.setCache('userIds', (2, 's2'))
+        self.assertEqual(self.storage.getCache('userIds'), (2, 's2'))
+
+    def test_get_expired_cache(self):
+        self.storage.setCache('noteStoreUrl', 'https://url')
+        self.assertIsNone(self.storage.getCache('noteStoreUrl', -1))
+
+    def test_remove_user_clears_cache(self):
+        self.storage.setCache('noteStoreUrl', 'https://url')
+        self.storage.removeUser()
+        self.assertIsNone(self.storage.getCache('noteStoreUrl'))
+
 
 class modelsTest(unittest.TestCase):
     def test_rept_userprop(self):
@@ -170,6 +191,11 @@ class modelsTest(unittest.TestCase):
                           guid='testguid')
         self.assertEqual(tag.__repr__(), "<Tag('testtag')>")
 
+    def test_repr_cache(self):
+        cache = storage.Cache(key='test', value='value')
+        self.assertEqual(cache.__repr__(),
+                         "<Cache('test','%s')>" % cache.timestamp)
+
     def test_repr_search(self):
         search = storage.Search(search_obj='query')
         self.assertEqual(search.__repr__(),
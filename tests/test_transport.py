@@ -0,0 +1,137 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+from thrift.protocol.TBinaryProtocol import TBinaryProtocol
+from thrift.Thrift import TMessageType
+from thrift.transport.TTransport import TMemoryBuffer, TTransportException
+
+from geeknote.stats import stats
+from geeknote.transport import ConnectionPool, PooledHttpClient, Recorder, Replayer
+
+
+class EchoHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    status = 200
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        self.server.ports.append(self.client_address[1])
+        self.send_response(self.status)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class testTransport(unittest.TestCase):
+
+    def setUp(self):
+        self.server = HTTPServer(("127.0.0.1", 0), EchoHandler)
+        self.server.ports = []
+        self.thread = threading.Thread(target=self.server.serve_forever, args=(0.05,))
+        self.thread.daemon = True
+        self.thread.start()
+        self.uri = "http://127.0.0.1:%s/edam/note" % self.server.server_port
+        self.pool = ConnectionPool(maxSize=2, idleTimeout=60, perHostLimit=2)
+
+    def tearDown(self):
+        self.pool.clear()
+        self.server.shutdown()
+        self.server.server_close()
+        EchoHandler.status = 200
+
+    def request(self, client, data):
+        client.write(data)
+        client.flush()
+        return client.read(len(data))
+
+    def test_request_roundtrip(self):
+        client = PooledHttpClient(self.uri, self.pool)
+        self.assertEqual(self.request(client, b"ping"), b"ping")
+
+    def test_connection_reused(self):
+        client = PooledHttpClient(self.uri, self.pool)
+        other = PooledHttpClient(self.uri, self.pool)
+        self.request(client, b"one")
+        self.request(other, b"two")
+        self.request(client, b"three")
+        self.assertEqual(len(set(self.server.ports)), 1)
+
+    def test_idle_connection_expired(self):
+        self.pool.idleTimeout = -1
+        client = PooledHttpClient(self.uri, self.pool)
+        self.request(client, b"one")
+        self.request(client, b"two")
+        self.assertEqual(len(set(self.server.ports)), 2)
+
+    def test_http_error_raises(self):
+        EchoHandler.status = 503
+        client = PooledHttpClient(self.uri, self.pool)
+        with self.assertRaises(TTransportException):
+            self.request(client, b"ping")
+        self.assertEqual(client.code, 503)
+
+    def test_stats_recorded(self):
+        buffer = TMemoryBuffer()
+        TBinaryProtocol(buffer).writeMessageBegin("listTags", TMessageType.CALL, 1)
+        message = buffer.getvalue()
+
+        stats.reset()
+        client = PooledHttpClient(self.uri, self.pool)
+        self.request(client, message)
+        self.request(client, message)
+        entry = stats.summary()["listTags"]
+        self.assertEqual(entry["calls"], 2)
+        self.assertEqual(entry["bytesSent"], 2 * len(message))
+        self.assertEqual(entry["bytesReceived"], 2 * len(message))
+        stats.reset()
+
+    def test_record_and_replay(self):
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, "session.jsonl")
+            client = PooledHttpClient(self.uri, self.pool)
+            client.recorder = Recorder(path)
+            self.request(client, b"one")
+            self.request(client, b"two")
+            self.request(client, b"one\x00\xff")
+            client.recorder.file.close()
+            self.server.shutdown()
+
+            client = PooledHttpClient(self.uri, self.pool)
+            client.replayer = Replayer(path)
+            self.assertEqual(self.request(client, b"one\x00\xff"), b"one\x00\xff")
+            self.assertEqual(self.request(client, b"two"), b"two")
+            self.assertEqual(self.request(client, b"one"), b"one")
+            with self.assertRaises(TTransportException):
+                self.request(client, b"one")
+
+            client.replayer = Replayer(path, latency="0.05")
+            start = time.monotonic()
+            self.request(client, b"two")
+            self.assertGreaterEqual(time.monotonic() - start, 0.05)
+        finally:
+            shutil.rmtree(directory)
+
+    def test_pool_size_limit(self):
+        pool = ConnectionPool(maxSize=1, idleTimeout=60, perHostLimit=2)
+        first, _ = pool.acquire("host", lambda: ConnectionStub())
+        second, _ = pool.acquire("host", lambda: ConnectionStub())
+        pool.release("host", first)
+        pool.release("host", second)
+        self.assertEqual(len(pool.idle["host"]), 1)
+        self.assertTrue(first.closed)
+
+
+class ConnectionStub(object):
+    closed = False
+
+    def close(self):
+        self.closed = True